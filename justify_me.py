@@ -18,6 +18,9 @@
 # lines, parsing the content to calculate how much time was spent under each
 # heading. It reports some summary statistics.
 #
+# The scraping and reporting functions live in labbook.timesheet, and the same
+# report is available as `labbook.py timesheet`.
+#
 # TODO: Turn output into JSON/graphical output
 #
 # (c) L.Pritchard 2014
@@ -25,19 +28,27 @@
 ###
 # IMPORTS
 
-import codecs
 import logging
 import logging.handlers
 
 import os
-import re
 import sys
 import traceback
 
-import pandas as pd
-
 from argparse import ArgumentParser
-from collections import defaultdict
+
+from labbook.ledger import TimeLedger
+from labbook.topics import TopicIndex
+from labbook.timesheet import (
+    intervals_to_times,
+    process_labbooks,
+    report_by_day,
+    report_conflicts,
+    report_total_time,
+    scrape_intervals,
+    times_to_df,
+    wallclock_time,
+)
 
 
 ###
@@ -79,142 +90,39 @@ def parse_cmdline(args):
         default=False,
         help="write tab-separated file of time recorded",
     )
+    parser.add_argument(
+        "--conflicts",
+        dest="conflicts",
+        action="store_true",
+        default=False,
+        help="report overlapping and unrecorded time within each day",
+    )
+    parser.add_argument(
+        "--wallclock",
+        dest="wallclock",
+        action="store_true",
+        default=False,
+        help="also report total time with overlaps counted only once",
+    )
+    parser.add_argument(
+        "-I",
+        "--include-path",
+        dest="searchpaths",
+        action="append",
+        default=[],
+        help="directory to search for \\input{} and \\include{} files",
+    )
+    parser.add_argument(
+        "-y",
+        "--yaml",
+        dest="yamlfile",
+        action="store",
+        default=None,
+        help="YAML config file, to total time under its project names",
+    )
     return parser.parse_args()
 
 
-# Traverse subdirectories, collecting .tex files and processing the headers
-def process_labbooks():
-    """ Starting from the input directory, traverse all subdirectories,
-        finding .tex files. Process each .tex file to find time spent under
-        each heading, and collate.
-    """
-    # Traverse subdirectories and get list of lab book locations
-    texfiles = []
-    for root, dirs, files in os.walk(args.indirname):
-        texfiles.extend(
-            [os.path.join(root, f) for f in files if os.path.splitext(f)[-1] == ".tex"]
-        )
-
-    # Process each book, returning a list of tuples:
-    # (filename, [(activity, minutes)])
-    return [(os.path.split(texfile)[-1], scrape_time(texfile)) for texfile in texfiles]
-
-
-# Report time spent by lab book day
-def report_by_day(times, outstream):
-    """ Report time spent by lab book day
-    """
-    for filename, tlist in sorted(times):
-        outstream.write("\n%s:\n" % filename)
-        total = 0
-        for topic, t in sorted(tlist):
-            if t:
-                outstream.write("\t%30s:\t%.2fh\n" % (topic, t / 60.))
-                total += t
-        outstream.write("Total time recorded: %.2fh\n" % (total / 60.))
-
-
-# Report total time recorded in lab boo
-def report_total_time(times, outstream):
-    """ Report time recorded across all lab books
-    """
-    totals = defaultdict(int)
-    days = 0
-    outstream.write("\nTotal time recorded:\n")
-    for filename, tlist in sorted(times):
-        days += 1
-        for topic, t in sorted(tlist):
-            if t:
-                totals[topic.upper()] += t
-    total = sum(totals.values())
-    for topic, t in sorted(totals.items()):
-        outstream.write(
-            "\t%30s:\t%dh%dm\t%.2fh\t(%.2f%%)\n"
-            % (topic, (t - t % 60) / 60, t % 60, t / 60., 100. * t / total)
-        )
-    if total:
-        outstream.write(
-            "Total time recorded: %dh%dm\t%.2fh\n"
-            % ((total - total % 60) / 60, total % 60, total / 60.)
-        )
-        outstream.write(
-            "Total time recorded per lab book: %dh%dm\t%.2fh\n"
-            % (
-                ((total - total % 60) / 60) / days,
-                (total % 60) / days,
-                total / 60. / days,
-            )
-        )
-
-
-# Takes an iterable of .tex files and processes \section and \subsection
-# headers to scrape times spent under the header
-def scrape_time(filename):
-    """ Loops over a .tex file and scrapes the
-        time spent (in format HHMM-HHMM) from each \section and \subsection
-        header.
-    """
-    section_re = r"((?<=\\section\{).*(?=\}))"
-    logger.info("Scraping %s" % filename)
-    with codecs.open(filename, "rU", encoding="utf-8", errors="ignore") as fh:
-        data = fh.read()
-        # Get \section{} and \subsection{} elements
-        matches = [
-            m for m in re.findall(section_re, data) if len(m.strip()) and ":" in m
-        ]
-        # Process matches into subject, time values
-        times = [process_match(m) for m in matches]
-    return times
-
-
-# Convert the section/subsection headers into a topic name and time spent
-def process_match(match):
-    """ Takes a string regex match for a (sub)section header of format:
-        TOPIC: HHMM-HHMM; HHMM-HHMM...
-        and returns a tuple of (TOPIC, TIME SPENT IN MINUTES)
-    """
-    time_re = "[0-9]{4}-[0-9]{4}"
-    topic, times = match.split(":", 1)
-    topic = topic.strip()
-    times = re.findall(time_re, times)
-    if not len(times):
-        return (topic, 0)
-    return (topic, calc_time(times))
-
-
-# Convert string times HHMM-HHMM into time spent
-def calc_time(times):
-    """ Takes a list of times in HHMM-HHMM format, and returns the difference
-        between the first and second times
-    """
-    cumt = 0
-    for t in times:
-        t1, t2 = t.split("-")
-        tm = (int(t2[2:]) - int(t1[2:])) % 60
-        th = 60 * ((int(t2[:2]) - int(t1[:2])) % 24)
-        if int(t2[2:]) < int(t1[2:]):
-            th -= 60
-        cumt += tm + th
-    return cumt
-
-
-# Convert list of time tuples to pandas daraframe
-def times_to_df(times):
-    """Returns a long-form dataframe where columns are date, activity, and time
-    """
-    columns = ["date", "activity", "time"]
-    df = pd.DataFrame(columns=columns)
-    index = 0
-    for time in times:
-        date = os.path.splitext(time[0])[0]
-        for activity, time in time[1]:
-            if time != 0:
-                print(date, activity, time)
-                df.loc[index] = [str(date).strip(), str(activity).strip(), int(time)]
-                index += 1
-    return df
-
-
 ###
 # SCRIPT
 
@@ -263,16 +171,42 @@ if __name__ == "__main__":
             )
             sys.exit(1)
 
-    # Process lab books
-    times = process_labbooks()
+    # Process lab books. If we need to compare time ranges, scrape them once
+    # and derive the time spent from them
+    if args.conflicts or args.wallclock:
+        intervals = process_labbooks(
+            args.indirname, scrape_intervals, logger, args.searchpaths
+        )
+        times = intervals_to_times(intervals)
+    else:
+        times = process_labbooks(
+            args.indirname, logger=logger, searchpaths=args.searchpaths
+        )
 
     if not args.tabular:
         logger.info("Reporting time by day")
-        # Report time spent by day and total time spent
-        report_by_day(times, outfhandle)
-        report_total_time(times, outfhandle)
+        # Report time spent by day and total time spent, from one ledger
+        ledger = TimeLedger.from_times(times)
+        report_by_day(ledger, outfhandle)
+        if args.conflicts:
+            logger.info("Reporting overlapping and unrecorded time")
+            report_conflicts(intervals, outfhandle)
+        normalise = None
+        if args.yamlfile is not None:
+            logger.info("Normalising topics to names in %s" % args.yamlfile)
+            topic_index = TopicIndex.from_yamlfile(args.yamlfile)
+            normalise = topic_index.normalise
+        if args.wallclock:
+            report_total_time(
+                ledger, outfhandle, wallclock_time(intervals), normalise
+            )
+        else:
+            report_total_time(ledger, outfhandle, normalise=normalise)
+        if normalise is not None:
+            for topic, canonical in topic_index.remapped():
+                logger.warning("Totalled topic %s under %s" % (topic, canonical))
     else:
         logger.info("Writing time to timedump.tab")
-        time_df = times_to_df(times)
+        time_df = times_to_df(times, logger)
         time_df.to_csv("timedump.tab", sep="\t", header=True, index=False)
 
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""archives.py
+
+Provides functions to pack lab books into, and read them from, archives
+
+Lab books that are no longer edited (e.g. a past year) can be packed into a
+single .zip archive. The archive's central directory is an index of its
+members, so the scanners can read lab books from it with one open and a
+sequential read, rather than opening thousands of small files.
+
+Files inside an archive are addressed with a path that runs through the
+archive, e.g.
+
+2016.zip/01_january/2016-01-04/2016-01-04.tex
+
+and the functions here accept these paths, ordinary paths and gzipped
+(.tex.gz) lab books interchangeably.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact: leighton.pritchard@hutton.ac.uk
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import gzip
+import os
+import tempfile
+import zipfile
+
+
+# File extensions for lab book sources and archives
+TEX_EXTENSIONS = ('.tex', '.tex.gz')
+ARCHIVE_EXTENSIONS = ('.zip',)
+
+# Open archives, keyed by absolute path. Each value is a tuple of
+# (mtime, ZipFile, set of member names), so that each archive is opened and
+# indexed once, and reopened only if it is modified.
+ARCHIVE_CACHE = {}
+
+
+def is_texfile(path):
+    """Returns True if path names a (possibly gzipped) LaTeX source."""
+    return path.lower().endswith(TEX_EXTENSIONS)
+
+
+def is_archive(path):
+    """Returns True if path names a lab book archive."""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def split_archive_path(path):
+    """Returns (archive, member) for a path that runs through an archive.
+
+    If the path is not inside an archive, returns (None, path), with path
+    made absolute and normalised, so that a path that runs through an
+    archive's name and back out with .. names the file outside it.
+    """
+    path = os.path.abspath(path)
+    lowered = path.lower()
+    if not any(ext + os.sep in lowered for ext in ARCHIVE_EXTENSIONS):
+        return None, path
+    parts = path.split(os.sep)
+    for idx in range(len(parts) - 1, 0, -1):
+        prefix = os.sep.join(parts[:idx])
+        if is_archive(prefix) and os.path.isfile(prefix):
+            return prefix, '/'.join(parts[idx:])
+    return None, path
+
+
+def open_archive(archive):
+    """Returns (mtime, ZipFile, member names) for the passed archive.
+
+    Archives are opened once, and kept open in ARCHIVE_CACHE until they are
+    modified.
+    """
+    archive = os.path.abspath(archive)
+    mtime = os.stat(archive).st_mtime_ns
+    if archive in ARCHIVE_CACHE and ARCHIVE_CACHE[archive][0] == mtime:
+        return ARCHIVE_CACHE[archive]
+    if archive in ARCHIVE_CACHE:
+        ARCHIVE_CACHE[archive][1].close()
+    zfh = zipfile.ZipFile(archive, 'r')
+    ARCHIVE_CACHE[archive] = (mtime, zfh, set(zfh.namelist()))
+    return ARCHIVE_CACHE[archive]
+
+
+def list_archive(archive):
+    """Returns paths (through the archive) to the lab books in an archive.
+
+    Members are returned in archive order, so that reading them in turn is
+    a sequential read of the archive.
+    """
+    archive = os.path.abspath(archive)
+    zfh = open_archive(archive)[1]
+    return [os.path.join(archive, *info.filename.split('/'))
+            for info in zfh.infolist()
+            if not info.is_dir() and is_texfile(info.filename)]
+
+
+def isfile(path):
+    """Returns True if path is a file, or a member of an archive."""
+    archive, member = split_archive_path(path)
+    if archive is None:
+        return os.path.isfile(member)
+    return member in open_archive(archive)[2]
+
+
+def get_mtime(path):
+    """Returns the modification time (ns) of a file.
+
+    Archive members take the modification time of their archive.
+    """
+    archive, member = split_archive_path(path)
+    return os.stat(member if archive is None else archive).st_mtime_ns
+
+
+def read_text(path):
+    """Returns the text of a file, archive member, or gzipped file.
+
+    Text is decoded as UTF-8, ignoring errors, as lab books have always been.
+    """
+    archive, member = split_archive_path(path)
+    if archive is None:
+        with open(member, 'rb') as ifh:
+            data = ifh.read()
+    else:
+        data = open_archive(archive)[1].read(member)
+    if path.lower().endswith('.gz'):
+        data = gzip.decompress(data)
+    return data.decode('utf-8', errors='ignore')
+
+
+def find_texfiles(dirname):
+    """Returns paths to lab book sources, and archives, beneath dirname."""
+    texfiles, archives = [], []
+    for root, dirs, files in os.walk(dirname):
+        dirs.sort()
+        for fname in sorted(files):
+            if is_texfile(fname):
+                texfiles.append(os.path.join(root, fname))
+            elif is_archive(fname):
+                archives.append(os.path.join(root, fname))
+    return texfiles, archives
+
+
+def get_umask():
+    """Returns the process umask."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def pack_labbooks(dirname, outpath, logger):
+    """Pack the lab book sources beneath dirname into a .zip archive.
+
+    Members are named relative to dirname, and stored in sorted order. The
+    archive is written to a temporary file and moved into place once it is
+    complete, so an existing archive is never left half-written. Returns
+    the list of packed files.
+    """
+    texfiles = find_texfiles(dirname)[0]
+    outdir = os.path.dirname(os.path.abspath(outpath))
+    tmpfd, tmppath = tempfile.mkstemp(suffix='.zip', dir=outdir)
+    os.close(tmpfd)
+    try:
+        with zipfile.ZipFile(tmppath, 'w', zipfile.ZIP_DEFLATED) as zfh:
+            for texfile in texfiles:
+                arcname = os.path.relpath(texfile, dirname)
+                logger.info("Packing %s", arcname)
+                zfh.write(texfile, arcname.replace(os.sep, '/'))
+        with zipfile.ZipFile(tmppath, 'r') as zfh:
+            bad = zfh.testzip()
+        if bad is not None:
+            raise zipfile.BadZipFile("Corrupt member %s in %s" %
+                                     (bad, tmppath))
+        # mkstemp() creates the file readable only by its owner; give the
+        # archive the permissions a new file would normally have
+        os.chmod(tmppath, 0o666 & ~get_umask())
+        os.replace(tmppath, outpath)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+    return texfiles
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""assets.py
+
+Provides functions to manage the graphics included in lab books
+
+The preflight sets \\graphicspath{{graphics/}}, so each lab book's graphics
+live in a graphics/ directory beside it, and the same image is often saved
+into many of them. These functions hash the files in those directories,
+deduplicate identical files into a content-addressed store by hardlinking
+them to a single copy, and find files that no lab book includes.
+
+Hashes are kept in an index in the store, keyed by path, size and
+modification time, so only new or changed files are hashed again. Hashing
+runs in a thread pool, as hashlib releases the GIL while hashing.
+
+Deduplicated copies are hardlinks to the same file, so editing one of them
+in place changes it in every lab book that links to it, and leaves the
+stored copy under a digest that no longer matches its content. Such stale
+copies are found on the next run (see verify_store()).
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact: leighton.pritchard@hutton.ac.uk
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import re
+import tempfile
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import archives
+
+
+# Name of graphics directories, as set by \graphicspath in the preflight
+GRAPHICS_DIRNAME = 'graphics'
+
+# Name of the hash index in the store
+INDEX_FILENAME = 'index.json'
+
+# Size of blocks to read when hashing
+BLOCKSIZE = 1 << 20
+
+
+def find_graphics_dirs(dirname, graphics_dirname=GRAPHICS_DIRNAME):
+    """Returns paths to the graphics directories beneath dirname."""
+    graphics_dirs = []
+    for root, dirs, files in os.walk(dirname):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        if os.path.basename(root) == graphics_dirname:
+            graphics_dirs.append(root)
+            dirs[:] = []
+    return graphics_dirs
+
+
+def find_assets(graphics_dirs):
+    """Returns a dictionary of asset file paths, keyed by graphics directory.
+    """
+    assets = {}
+    for graphics_dir in graphics_dirs:
+        assets[graphics_dir] = []
+        for root, dirs, files in os.walk(graphics_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            assets[graphics_dir].extend(os.path.join(root, fname)
+                                        for fname in sorted(files)
+                                        if not fname.startswith('.'))
+    return assets
+
+
+def load_index(storedir):
+    """Returns the hash index from the store, or an empty index.
+
+    The index maps paths to [size, mtime, SHA-256 hex digest].
+    """
+    indexpath = os.path.join(storedir, INDEX_FILENAME)
+    if not os.path.isfile(indexpath):
+        return {}
+    with open(indexpath, 'r') as ifh:
+        return json.load(ifh)
+
+
+def save_index(storedir, index):
+    """Write the hash index to the store, replacing any existing index."""
+    os.makedirs(storedir, exist_ok=True)
+    tmpfd, tmppath = tempfile.mkstemp(suffix='.json', dir=storedir)
+    with os.fdopen(tmpfd, 'w') as ofh:
+        json.dump(index, ofh, indent=0, sort_keys=True)
+    os.replace(tmppath, os.path.join(storedir, INDEX_FILENAME))
+
+
+def hash_file(path):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as ifh:
+        for block in iter(lambda: ifh.read(BLOCKSIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_assets(paths, index, workers=None, logger=None):
+    """Returns a dictionary of SHA-256 hex digests, keyed by path.
+
+    Files whose size and modification time match their entry in index are
+    not hashed again. The remaining files are hashed in parallel with
+    workers threads, and index is updated in place.
+    """
+    digests, stale = {}, []
+    for path in paths:
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        if key in index and index[key][:2] == [stat.st_size,
+                                               stat.st_mtime_ns]:
+            digests[path] = index[key][2]
+        else:
+            stale.append((path, stat))
+    if logger is not None:
+        logger.info("Hashing %d new or changed files (%d unchanged)",
+                    len(stale), len(digests))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (path, stat), digest in zip(stale,
+                                        executor.map(hash_file,
+                                                     [p for p, s in stale])):
+            digests[path] = digest
+            index[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns,
+                                            digest]
+    return digests
+
+
+def group_duplicates(digests):
+    """Returns a dictionary of paths with identical content, keyed by digest.
+
+    Only contents held in more than one file are returned.
+    """
+    groups = defaultdict(list)
+    for path, digest in digests.items():
+        groups[digest].append(path)
+    return {digest: sorted(paths) for digest, paths in groups.items()
+            if len(paths) > 1}
+
+
+def duplicate_size(duplicates):
+    """Returns the bytes used by extra copies of duplicated contents.
+
+    Files that are already hardlinks to the same copy use no extra space.
+    """
+    size = 0
+    for paths in duplicates.values():
+        stats = [os.stat(path) for path in paths]
+        copies = {(stat.st_dev, stat.st_ino) for stat in stats}
+        size += stats[0].st_size * (len(copies) - 1)
+    return size
+
+
+def store_path(storedir, digest, path):
+    """Returns the path in the store for content with the passed digest.
+
+    The original file extension is kept, so stored files can be viewed.
+    """
+    ext = os.path.splitext(path)[-1].lower()
+    return os.path.join(storedir, 'objects', digest[:2], digest[2:] + ext)
+
+
+def dedup_assets(digests, storedir, index, dry_run=False, logger=None):
+    """Replace duplicated assets with hardlinks to a single stored copy.
+
+    The first file with each duplicated content is hardlinked into the
+    store, and the other files are replaced by hardlinks to it. Files are
+    replaced atomically. Returns (files replaced, bytes saved).
+    """
+    replaced, saved = 0, 0
+    for digest, paths in sorted(group_duplicates(digests).items()):
+        objpath = store_path(storedir, digest, paths[0])
+        if not os.path.isfile(objpath):
+            if dry_run:
+                objpath = paths[0]
+            else:
+                os.makedirs(os.path.dirname(objpath), exist_ok=True)
+                try:
+                    os.link(paths[0], objpath)
+                except OSError as err:
+                    if logger is not None:
+                        logger.warning("Could not store %s (%s)", paths[0],
+                                       err)
+                    continue
+                stat = os.stat(objpath)
+                index[os.path.abspath(objpath)] = [stat.st_size,
+                                                   stat.st_mtime_ns, digest]
+        for path in paths:
+            if os.path.samefile(path, objpath):
+                continue
+            size = os.stat(path).st_size
+            if logger is not None:
+                logger.info("Linking %s to %s", path, objpath)
+            if not dry_run:
+                try:
+                    link_replace(objpath, path)
+                except OSError as err:
+                    if logger is not None:
+                        logger.warning("Could not link %s (%s)", path, err)
+                    continue
+                stat = os.stat(path)
+                index[os.path.abspath(path)] = [stat.st_size,
+                                                stat.st_mtime_ns, digest]
+            replaced += 1
+            saved += size
+    return replaced, saved
+
+
+def verify_store(storedir, index, workers=None, logger=None):
+    """Returns paths to stored copies whose content no longer matches their
+    digest.
+
+    This happens when a deduplicated graphic is edited in place, as every
+    hardlink to the stored copy (in every lab book) changes with it. Stored
+    copies are hashed incrementally, as in hash_assets().
+    """
+    objdir = os.path.join(storedir, 'objects')
+    objpaths = []
+    for root, dirs, files in os.walk(objdir):
+        dirs.sort()
+        objpaths.extend(os.path.join(root, fname) for fname in sorted(files))
+    digests = hash_assets(objpaths, index, workers)
+    return [path for path in objpaths if digests[path] !=
+            os.path.basename(os.path.dirname(path)) +
+            os.path.splitext(os.path.basename(path))[0]]
+
+
+def link_replace(source, path):
+    """Atomically replace path with a hardlink to source."""
+    tmppath = os.path.join(os.path.dirname(path),
+                           '.%s.tmp' % os.path.basename(path))
+    os.link(source, tmppath)
+    try:
+        os.replace(tmppath, path)
+    except OSError:
+        os.remove(tmppath)
+        raise
+
+
+def find_graphics_references(texfiles):
+    """Returns the set of names passed to \\includegraphics in the lab books.
+
+    Lab books in archives and gzipped lab books are read, and commented-out
+    lines are ignored.
+    """
+    include_re = re.compile(r'\\includegraphics\s*(?:\[[^\]]*\])?\s*\{([^}]+)\}')
+    comment_re = re.compile(r'(?<!\\)%.*')
+    references = set()
+    for texfile in texfiles:
+        for line in archives.read_text(texfile).splitlines():
+            references.update(name.strip() for name in
+                              include_re.findall(comment_re.sub('', line)))
+    return references
+
+
+def find_unused(assets, references):
+    """Returns the sorted asset paths not named by any \\includegraphics.
+
+    As with \\graphicspath, an asset is named by its path relative to its
+    graphics directory, with or without its file extension. It may also be
+    named by its path relative to the directory containing the graphics
+    directory (e.g. graphics/img1.png), as it would be from a lab book
+    there.
+    """
+    names = set()
+    for name in references:
+        name = posixpath.normpath(name.replace(os.sep, '/'))
+        names.update((name, os.path.splitext(name)[0]))
+    unused = []
+    for graphics_dir, paths in assets.items():
+        for path in paths:
+            candidates = [os.path.relpath(path, basedir).replace(os.sep, '/')
+                          for basedir in (graphics_dir,
+                                          os.path.dirname(graphics_dir))]
+            if not any(name in names or os.path.splitext(name)[0] in names
+                       for name in candidates):
+                unused.append(path)
+    return sorted(unused)
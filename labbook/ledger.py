@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""ledger.py
+
+Provides a compact, array-backed ledger of time recorded in lab books
+
+Scraped time is returned as a list of (filename, [(topic, minutes), ...])
+tuples, which holds a Python string and tuple for every header scraped.
+TimeLedger instead interns each lab book and topic name once, and keeps one
+entry per header as integers in typed arrays. Totals by day or by topic are
+grouped sums over the arrays, computed with NumPy (which is only imported
+when totals are needed, as it is slow to import).
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact: leighton.pritchard@hutton.ac.uk
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from array import array
+
+
+class TimeLedger(object):
+    """Time recorded in lab books, held in typed arrays.
+
+    Lab book names (days) and topics are interned, and each entry is stored
+    as a day ID, topic ID and number of minutes. Entries recording no time
+    are not stored.
+    """
+
+    __slots__ = ('days', 'day_ids', 'topics', 'topic_ids', 'day', 'topic',
+                 'minutes')
+
+    def __init__(self):
+        self.days = []              # day ID -> lab book name
+        self.day_ids = {}           # lab book name -> day ID
+        self.topics = []            # topic ID -> topic
+        self.topic_ids = {}         # topic -> topic ID
+        self.day = array('l')       # entry -> day ID
+        self.topic = array('l')     # entry -> topic ID
+        self.minutes = array('l')   # entry -> minutes
+
+    @classmethod
+    def from_times(cls, times):
+        """Returns a TimeLedger of the output of process_labbooks()."""
+        ledger = cls()
+        ledger.extend(times)
+        return ledger
+
+    def intern_day(self, filename):
+        """Returns the day ID for a lab book name, adding it if necessary."""
+        if filename not in self.day_ids:
+            self.day_ids[filename] = len(self.days)
+            self.days.append(filename)
+        return self.day_ids[filename]
+
+    def intern_topic(self, topic):
+        """Returns the topic ID for a topic, adding it if necessary."""
+        if topic not in self.topic_ids:
+            self.topic_ids[topic] = len(self.topics)
+            self.topics.append(topic)
+        return self.topic_ids[topic]
+
+    def extend(self, times):
+        """Add the output of process_labbooks() to the ledger.
+
+        Every lab book is recorded as a day, even if it records no time.
+        """
+        days, topics, minutes = [], [], []
+        for filename, tlist in times:
+            day_id = self.intern_day(filename)
+            for topic, t in tlist:
+                if t:
+                    topic_id = self.topic_ids.get(topic)
+                    if topic_id is None:
+                        topic_id = self.intern_topic(topic)
+                    days.append(day_id)
+                    topics.append(topic_id)
+                    minutes.append(t)
+        self.day.extend(days)
+        self.topic.extend(topics)
+        self.minutes.extend(minutes)
+
+    def columns(self):
+        """Returns the day ID, topic ID and minutes of each entry as NumPy
+        arrays, sharing memory with the ledger."""
+        import numpy as np
+
+        return [np.frombuffer(column, dtype=column.typecode)
+                for column in (self.day, self.topic, self.minutes)]
+
+    def total_by_topic(self, key=None):
+        """Returns a dictionary of total minutes, keyed by topic group.
+
+        Topics are grouped by key(topic) (default: the topic itself), which
+        is called once per distinct topic, not once per entry.
+        """
+        import numpy as np
+
+        names, name_ids, groups = [], {}, []
+        for topic in self.topics:
+            name = topic if key is None else key(topic)
+            if name not in name_ids:
+                name_ids[name] = len(names)
+                names.append(name)
+            groups.append(name_ids[name])
+        day, topic, minutes = self.columns()
+        groups = np.array(groups, dtype=np.int64)[topic]
+        totals = np.bincount(groups, weights=minutes, minlength=len(names))
+        return dict(zip(names, totals.astype(np.int64).tolist()))
+
+    def total_by_day_topic(self):
+        """Returns minutes summed by lab book and topic, sorted by name.
+
+        Returns (days, bounds, topics, minutes): days is the sorted list of
+        lab book names, and the totals for days[idx] are the rows
+        bounds[idx]:bounds[idx + 1] of topics and minutes, sorted by topic.
+        Lab books that record no time have no rows.
+        """
+        import numpy as np
+
+        day, topic, minutes = self.columns()
+        day_order = sorted(range(len(self.days)), key=self.days.__getitem__)
+        topic_order = sorted(range(len(self.topics)),
+                             key=self.topics.__getitem__)
+        day_rank = np.empty(len(self.days), dtype=np.int64)
+        day_rank[day_order] = np.arange(len(self.days))
+        topic_rank = np.empty(len(self.topics), dtype=np.int64)
+        topic_rank[topic_order] = np.arange(len(self.topics))
+
+        # Sum minutes for each (day, topic) pair, in sorted order
+        ntopics = max(len(self.topics), 1)
+        keys, inverse = np.unique(day_rank[day] * ntopics + topic_rank[topic],
+                                  return_inverse=True)
+        totals = np.bincount(inverse, weights=minutes,
+                             minlength=len(keys)).astype(np.int64)
+        day_ranks, topic_ranks = np.divmod(keys, ntopics)
+
+        sorted_topics = [self.topics[idx] for idx in topic_order]
+        bounds = np.searchsorted(day_ranks, np.arange(len(self.days) + 1))
+        return ([self.days[idx] for idx in day_order], bounds.tolist(),
+                [sorted_topics[idx] for idx in topic_ranks.tolist()],
+                totals.tolist())
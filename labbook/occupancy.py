@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""occupancy.py
+
+Provides minute-of-day occupancy matrices of time recorded in lab books
+
+The HHMM-HHMM ranges scraped from lab books are flattened into NumPy arrays
+in a single pass, and the number of minutes spent in each minute of the day
+is counted for each group (topic, weekday, or both) at once: +1/-1 at the
+start/end of each range are accumulated into a difference array of 1441
+slots per group with np.bincount(), and a cumulative sum along each row
+gives the occupancy. The resulting matrices can be binned and written as
+tab-separated, heatmap-ready tables.
+
+NumPy is imported by the functions that use it, rather than by the module,
+so that importing this module (e.g. for GROUPINGS when building the
+command-line parser) doesn't pay for importing NumPy.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact: leighton.pritchard@hutton.ac.uk
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import calendar
+
+from . import timesheet
+
+
+# Minutes in a day
+DAY_MINUTES = 1440
+
+# Groupings available for occupancy tables
+GROUPINGS = ('topic', 'weekday', 'topic-weekday')
+
+
+def interval_arrays(intervals, normalise=None):
+    """Returns the time ranges from process_labbooks(scrape_intervals) as
+    arrays.
+
+    Returns a tuple of (TOPICS, ORDINALS, STARTS, ENDS, TOPIC_IDS), where
+    TOPICS is a list of topic names, and the others are arrays with an
+    element for each time range: the date ordinal of its lab book (0 if the
+    lab book isn't named YYYY-MM-DD.tex), its start and end in minutes since
+    midnight, and the index of its topic in TOPICS. Topics are upper-cased,
+    as in the time reports, after calling normalise(topic) if normalise is
+    passed. Invalid ranges (e.g. 2430-0100) have already been dropped by
+    timesheet.scrape_intervals().
+    """
+    import numpy as np
+
+    topics, topic_ids = [], {}
+    ordinals, starts, ends, tids = [], [], [], []
+    for filename, ilist in intervals:
+        ordinal = timesheet.labbook_ordinal(filename)
+        for topic, ranges in ilist:
+            if not ranges:
+                continue
+            topic = (topic if normalise is None else normalise(topic)).upper()
+            if topic not in topic_ids:
+                topic_ids[topic] = len(topics)
+                topics.append(topic)
+            for start, end in ranges:
+                ordinals.append(ordinal)
+                starts.append(start)
+                ends.append(end)
+                tids.append(topic_ids[topic])
+    return (topics, np.array(ordinals, dtype=np.int64),
+            np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+            np.array(tids, dtype=np.int64))
+
+
+def split_midnight(ordinals, starts, ends, tids):
+    """Returns (ORDINALS, STARTS, ENDS, TOPIC_IDS) arrays as from
+    interval_arrays(), with each range that runs past midnight (ends[i] >
+    1440) split in two.
+
+    The part after midnight is moved to the start of the next day, so it
+    takes the next date ordinal (unless its lab book isn't named by date).
+    """
+    import numpy as np
+
+    wraps = ends > DAY_MINUTES
+    next_days = np.where(ordinals[wraps] > 0, ordinals[wraps] + 1, 0)
+    return (np.concatenate([ordinals, next_days]),
+            np.concatenate([starts, np.zeros(wraps.sum(), dtype=np.int64)]),
+            np.concatenate([np.minimum(ends, DAY_MINUTES),
+                            ends[wraps] - DAY_MINUTES]),
+            np.concatenate([tids, tids[wraps]]))
+
+
+def occupancy_matrix(starts, ends, groups, ngroups):
+    """Returns an (ngroups, 1440) array of minutes recorded at each minute of
+    the day, for each group.
+
+    Each time range runs from starts[i] up to (not including) ends[i], in
+    minutes since midnight, and belongs to group groups[i]. Ranges must not
+    run past midnight (see split_midnight()).
+    """
+    import numpy as np
+
+    # Difference array with a spare slot per row for ranges ending at 2400
+    width = DAY_MINUTES + 1
+    size = ngroups * width
+    diff = (np.bincount(groups * width + starts, minlength=size) -
+            np.bincount(groups * width + ends, minlength=size))
+    return np.cumsum(diff.reshape(ngroups, width), axis=1)[:, :DAY_MINUTES]
+
+
+def check_binsize(binsize):
+    """Raises ValueError unless binsize minutes divide a day exactly."""
+    if binsize < 1 or DAY_MINUTES % binsize:
+        raise ValueError("Bin size %d does not divide a day (%d minutes)" %
+                         (binsize, DAY_MINUTES))
+
+
+def bin_matrix(matrix, binsize):
+    """Returns matrix with its minute-of-day columns summed into bins of
+    binsize minutes, which must divide a day exactly."""
+    check_binsize(binsize)
+    return matrix.reshape(matrix.shape[0], -1, binsize).sum(axis=2)
+
+
+def occupancy_table(intervals, by='topic', start=None, end=None,
+                    binsize=15, normalise=None):
+    """Returns a binned occupancy table for the output of
+    process_labbooks(scrape_intervals).
+
+    Returns a tuple of (ROWS, COLUMNS, MATRIX), where ROWS are the group
+    labels (topic, weekday, or both, as set by by), COLUMNS are the start
+    time (HHMM) of each bin of binsize minutes, and MATRIX holds the minutes
+    recorded in each bin for each group. Only lab books dated from start to
+    end (datetime.date, inclusive) are counted, if these are passed; lab
+    books that aren't named by date are not counted when a window is set or
+    when grouping by weekday.
+    """
+    import numpy as np
+
+    if by not in GROUPINGS:
+        raise ValueError("Unknown grouping %s (expected one of %s)" %
+                         (by, ', '.join(GROUPINGS)))
+    check_binsize(binsize)
+    topics, ordinals, starts, ends, tids = interval_arrays(intervals,
+                                                           normalise)
+    ordinals, starts, ends, tids = split_midnight(ordinals, starts, ends,
+                                                  tids)
+
+    # Restrict to the date window. Time after midnight counts on the next
+    # day
+    mask = np.ones(len(ordinals), dtype=bool)
+    if start is not None:
+        mask &= ordinals >= start.toordinal()
+    if end is not None:
+        mask &= ordinals <= end.toordinal()
+    if by != 'topic':
+        mask &= ordinals > 0
+    ordinals, starts, ends, tids = (ordinals[mask], starts[mask],
+                                    ends[mask], tids[mask])
+
+    # Assign each range to a group. Ordinal 1 (0001-01-01) is a Monday, so
+    # (ordinal - 1) % 7 matches date.weekday()
+    weekdays = (ordinals - 1) % 7
+    if by == 'topic':
+        groups, rows = tids, list(topics)
+    elif by == 'weekday':
+        groups, rows = weekdays, list(calendar.day_abbr)
+    else:
+        groups = tids * 7 + weekdays
+        rows = ['%s\t%s' % (topic, day) for topic in topics
+                for day in calendar.day_abbr]
+    matrix = bin_matrix(occupancy_matrix(starts, ends, groups, len(rows)),
+                        binsize)
+
+    # Order topics by name (then weekday), and drop empty groups
+    if by == 'weekday':
+        order = range(len(rows))
+    elif by == 'topic':
+        order = sorted(range(len(rows)), key=lambda idx: topics[idx])
+    else:
+        order = sorted(range(len(rows)),
+                       key=lambda idx: (topics[idx // 7], idx % 7))
+    keep = [idx for idx in order if matrix[idx].any()]
+    columns = ['%02d%02d' % divmod(minute, 60)
+               for minute in range(0, DAY_MINUTES, binsize)]
+    return [rows[idx] for idx in keep], columns, matrix[keep]
+
+
+def write_table(rows, columns, matrix, outstream, by='topic'):
+    """Write an occupancy table to outstream as tab-separated text."""
+    header = {'topic': ['topic'], 'weekday': ['weekday'],
+              'topic-weekday': ['topic', 'weekday']}[by]
+    outstream.write('\t'.join(header + columns) + '\n')
+    for row, values in zip(rows, matrix):
+        outstream.write('\t'.join([row] + [str(val) for val in values]) +
+                        '\n')
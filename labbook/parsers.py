@@ -5,6 +5,11 @@
 Provides functions to generate subcommand parsers for the labbook.py script
 
 - make_blank:        interact with config files
+- timesheet:         report time recorded in lab books
+- pack:              pack lab books into a single archive
+- assets:            deduplicate and check lab book graphics
+- retemplate:        update lab book headers after YAML config changes
+- occupancy:         tabulate when in the day time is recorded
 
 (c) The James Hutton Institute 2017
 Author: Leighton Pritchard
@@ -47,7 +52,7 @@ import sys
 
 from argparse import ArgumentParser
 
-from . import subcommands
+from . import assets, occupancy, subcommands, topics
 
 
 # Build common parser for all subcommands
@@ -90,6 +95,179 @@ def build_parser_make_blank(subparsers, parents=None):
     parser.set_defaults(func=subcommands.subcmd_make_blank)
     
 
+# Report time recorded in lab books
+def build_parser_timesheet(subparsers, parents=None):
+    """Add parser for `timesheet` subcommand to the subparsers
+
+    This parser implements options for reporting time recorded in lab books.
+    """
+    parser = subparsers.add_parser('timesheet', parents=parents)
+    parser.add_argument('paths', nargs='+', action='store',
+                        help='lab book files, or directories containing them')
+    parser.add_argument('-o', '--outfile', dest='outfilename',
+                        action='store', default=None,
+                        help='path to output file (default: STDOUT)')
+    parser.add_argument('--tabular', dest='tabular',
+                        action='store_true', default=False,
+                        help='write tab-separated table of time recorded')
+    parser.add_argument('--conflicts', dest='conflicts',
+                        action='store_true', default=False,
+                        help='report overlapping and unrecorded time')
+    parser.add_argument('--wallclock', dest='wallclock',
+                        action='store_true', default=False,
+                        help='report total time with overlaps counted once')
+    parser.add_argument('-I', '--include-path', dest='searchpaths',
+                        action='append', default=[],
+                        help='directory to search for \\input{} and ' +
+                        '\\include{} files (may be repeated)')
+    parser.add_argument('-y', '--yaml', dest='yamlfile',
+                        action='store', default=None,
+                        help='path to YAML config file, to total time ' +
+                        'under its project and subsection names')
+    parser.add_argument('--min-similarity', dest='min_similarity',
+                        action='store', type=float,
+                        default=topics.MIN_SIMILARITY,
+                        help='minimum trigram similarity for a topic to ' +
+                        'match a YAML name (default: %(default)s)')
+    parser.set_defaults(func=subcommands.subcmd_timesheet)
+
+
+# Pack lab books into an archive
+def build_parser_pack(subparsers, parents=None):
+    """Add parser for `pack` subcommand to the subparsers
+
+    This parser implements options for packing lab books (e.g. a year's
+    worth) into a single archive.
+    """
+    parser = subparsers.add_parser('pack', parents=parents)
+    parser.add_argument('indirname', action='store',
+                        help='directory containing lab books to pack')
+    parser.add_argument('-o', '--outfile', dest='outfilename',
+                        action='store', default=None,
+                        help='path to output archive (default: <indir>.zip)')
+    parser.add_argument('-f', '--force', dest='force',
+                        action='store_true', default=False,
+                        help='overwrite an existing archive')
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument('--remove', dest='remove',
+                         action='store_true', default=False,
+                         help='remove lab book sources once packed')
+    sources.add_argument('--keep', dest='remove',
+                         action='store_false',
+                         help='keep lab book sources once packed (scans ' +
+                         'read the archived copy and skip the sources)')
+    parser.set_defaults(func=subcommands.subcmd_pack)
+
+
+# Manage lab book graphics
+def build_parser_assets(subparsers, parents=None):
+    """Add parser for `assets` subcommand to the subparsers
+
+    This parser implements options for deduplicating the graphics included
+    in lab books, and finding those that aren't included.
+    """
+    parser = subparsers.add_parser('assets', parents=parents)
+    parser.add_argument('indirname', action='store',
+                        help='directory containing lab books and graphics')
+    parser.add_argument('-s', '--store', dest='storedir',
+                        action='store', default=None,
+                        help='path to asset store (default: <indir>/.assets)')
+    parser.add_argument('-g', '--graphics-dir', dest='graphics_dirname',
+                        action='store', default=assets.GRAPHICS_DIRNAME,
+                        help='name of graphics directories ' +
+                        '(default: %(default)s)')
+    parser.add_argument('--dedup', dest='dedup',
+                        action='store_true', default=False,
+                        help='replace duplicate graphics with hardlinks ' +
+                        'to a single stored copy. Linked copies share ' +
+                        'their content: editing one in place changes it ' +
+                        'in every lab book that links to it')
+    parser.add_argument('--dry-run', dest='dry_run',
+                        action='store_true', default=False,
+                        help='report what --dedup would do, without ' +
+                        'changing any files')
+    parser.add_argument('--unused', dest='unused',
+                        action='store_true', default=False,
+                        help='report graphics not included by any lab book')
+    parser.add_argument('-w', '--workers', dest='workers',
+                        action='store', type=int, default=None,
+                        help='number of threads for hashing')
+    parser.set_defaults(func=subcommands.subcmd_assets)
+
+
+# Update lab book headers after YAML config changes
+def build_parser_retemplate(subparsers, parents=None):
+    """Add parser for `retemplate` subcommand to the subparsers
+
+    This parser implements options for rewriting the project headers in
+    existing lab books when the YAML config changes.
+    """
+    parser = subparsers.add_parser('retemplate', parents=parents)
+    parser.add_argument('paths', nargs='+', action='store',
+                        help='lab book files, or directories containing them')
+    parser.add_argument('--old', dest='old_yamlfile',
+                        action='store', required=True,
+                        help='path to YAML config the lab books were made with')
+    parser.add_argument('-y', '--yaml', dest='yamlfile',
+                        action='store', default=None,
+                        help='path to new YAML config file')
+    parser.add_argument('--rename', dest='renames',
+                        action='append', default=[],
+                        help='pair an old project with a new one, as ' +
+                        '"OLD SECTION TITLE=>NEW SECTION TITLE" ' +
+                        '(may be repeated)')
+    parser.add_argument('--dry-run', dest='dry_run',
+                        action='store_true', default=False,
+                        help='write a diff of the changes, without ' +
+                        'rewriting any lab books')
+    parser.add_argument('-w', '--workers', dest='workers',
+                        action='store', type=int, default=None,
+                        help='number of worker processes')
+    parser.set_defaults(func=subcommands.subcmd_retemplate)
+
+
+# Tabulate when in the day time is recorded
+def build_parser_occupancy(subparsers, parents=None):
+    """Add parser for `occupancy` subcommand to the subparsers
+
+    This parser implements options for tabulating the minutes recorded at
+    each time of day, by topic and/or weekday.
+    """
+    parser = subparsers.add_parser('occupancy', parents=parents)
+    parser.add_argument('paths', nargs='+', action='store',
+                        help='lab book files, or directories containing them')
+    parser.add_argument('-o', '--outfile', dest='outfilename',
+                        action='store', default=None,
+                        help='path to output file (default: STDOUT)')
+    parser.add_argument('--by', dest='by',
+                        action='store', choices=occupancy.GROUPINGS,
+                        default='topic',
+                        help='group time by (default: %(default)s)')
+    parser.add_argument('--bin', dest='binsize',
+                        action='store', type=int, default=15,
+                        help='minutes in each time of day bin ' +
+                        '(default: %(default)s)')
+    parser.add_argument('--start', dest='start',
+                        action='store', default=None,
+                        help='first date to include (ISO 8061, YYYY-MM-DD)')
+    parser.add_argument('--end', dest='end',
+                        action='store', default=None,
+                        help='last date to include (ISO 8061, YYYY-MM-DD)')
+    parser.add_argument('-I', '--include-path', dest='searchpaths',
+                        action='append', default=[],
+                        help='directory to search for \\input{} and ' +
+                        '\\include{} files (may be repeated)')
+    parser.add_argument('-y', '--yaml', dest='yamlfile',
+                        action='store', default=None,
+                        help='path to YAML config file, to group time ' +
+                        'under its project and subsection names')
+    parser.add_argument('--min-similarity', dest='min_similarity',
+                        action='store', type=float,
+                        default=topics.MIN_SIMILARITY,
+                        help='minimum trigram similarity for a topic to ' +
+                        'match a YAML name (default: %(default)s)')
+    parser.set_defaults(func=subcommands.subcmd_occupancy)
+
 
 # Process command-line
 def parse_cmdline():
@@ -98,6 +276,11 @@ def parse_cmdline():
     The script offers a single main parser, with subcommands for the actions:
 
     make_blank - create a new blank lab book
+    timesheet  - report time recorded in lab books
+    pack       - pack lab books into a single archive
+    assets     - deduplicate and check lab book graphics
+    retemplate - update lab book headers after YAML config changes
+    occupancy  - tabulate when in the day time is recorded
     """
     # Main parent parser
     parser_main = ArgumentParser(prog='labbook.py')
@@ -110,6 +293,11 @@ def parse_cmdline():
 
     # Add subcommand parsers to the main parser's subparsers
     build_parser_make_blank(subparsers, parents=[parser_common])
+    build_parser_timesheet(subparsers, parents=[parser_common])
+    build_parser_pack(subparsers, parents=[parser_common])
+    build_parser_assets(subparsers, parents=[parser_common])
+    build_parser_retemplate(subparsers, parents=[parser_common])
+    build_parser_occupancy(subparsers, parents=[parser_common])
 
     # Catch calling the main script with no arguments (which would otherwise
     # not give a help message)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""retemplate.py
+
+Provides functions to update lab book headers after YAML config changes
+
+When project codes or names change in the YAML config, the headers written
+by subcommands.build_project_header() into existing lab books go stale.
+These functions compare the old and new configs to find the headers that
+changed, and rewrite only the lab books that contain them.
+
+Projects in the two configs are paired by a stable key rather than by
+position, so projects can be added, removed or reordered: first by any
+explicit renames, then by unchanged section titles, then by project number
+and activity, then by description and name. Projects that can't be paired
+unambiguously are reported and their headers left alone.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact: leighton.pritchard@hutton.ac.uk
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import difflib
+import os
+import re
+import shutil
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+
+def load_projects(yamlpath):
+    """Returns the list of projects in a YAML config file."""
+    with open(yamlpath) as yfh:
+        return yaml.safe_load(yfh).get('projects', [])
+
+
+def section_title(project):
+    """Returns the \\section{} title for a project (from YAML)."""
+    return '{0} {1}, {2}'.format(project['number'], project['description'],
+                                 project['name'])
+
+
+def comment_heading(project):
+    """Returns the comment heading and its rule for a project (from YAML)."""
+    rule = '%' * (len(project['name'] + project['description']) + 4)
+    return ('%% {0}, {1}'.format(project['description'], project['name']),
+            '%' + rule)
+
+
+def subsection_heading(name):
+    """Returns the comment heading and its rule for a subsection name."""
+    return '% {0}'.format(name), '%' + '=' * (len(name) + 2)
+
+
+def parse_renames(renames):
+    """Returns a dictionary of {old section title: new section title} from
+    strings of the form "OLD TITLE=>NEW TITLE".
+
+    Raises ValueError if a string isn't of this form.
+    """
+    mapping = {}
+    for rename in renames or []:
+        old, sep, new = rename.partition('=>')
+        if not sep or not old.strip() or not new.strip():
+            raise ValueError("Rename %r is not of the form OLD=>NEW" % rename)
+        mapping[old.strip()] = new.strip()
+    return mapping
+
+
+def activity_key(project):
+    """Returns the project number and activity of a project (from YAML)."""
+    return project['number'], project.get('activity')
+
+
+def name_key(project):
+    """Returns the description and name of a project (from YAML)."""
+    return project['description'], project['name']
+
+
+# Keys used to pair old and new projects, in the order they are tried
+PROJECT_KEYS = (section_title, activity_key, name_key)
+
+
+def pair_by_key(old_items, new_items, key):
+    """Returns a list of (old index, new index) pairs of items with the same
+    key, where that key is unique among both old and new items."""
+    old_keys, new_keys = {}, {}
+    for keys, items in ((old_keys, old_items), (new_keys, new_items)):
+        for idx, item in items.items():
+            keys.setdefault(key(item), []).append(idx)
+    return [(old_keys[k][0], new_keys[k][0]) for k in old_keys
+            if k in new_keys and len(old_keys[k]) == len(new_keys[k]) == 1]
+
+
+def pair_projects(old_projects, new_projects, renames=None, logger=None):
+    """Returns a list of (old project, new project) pairs.
+
+    Projects are paired by explicit renames ({old section title: new section
+    title}), then by each key in PROJECT_KEYS in turn, where that key
+    picks out a single project in each config. Old projects that can't be
+    paired are reported (if a logger is passed) and left out.
+    """
+    old_left = dict(enumerate(old_projects))
+    new_left = dict(enumerate(new_projects))
+    pairs = []
+
+    # Explicit renames
+    old_titles = {section_title(project): idx
+                  for idx, project in old_left.items()}
+    new_titles = {section_title(project): idx
+                  for idx, project in new_left.items()}
+    for old_title, new_title in (renames or {}).items():
+        if old_title not in old_titles:
+            raise ValueError("Renamed project %s is not in the old config" %
+                             old_title)
+        if new_title not in new_titles:
+            raise ValueError("Renamed project %s is not in the new config" %
+                             new_title)
+        if new_titles[new_title] not in new_left:
+            raise ValueError("Project %s is renamed from more than one "
+                             "project" % new_title)
+        pairs.append((old_left.pop(old_titles[old_title]),
+                      new_left.pop(new_titles[new_title])))
+
+    # Stable keys, most specific first
+    for key in PROJECT_KEYS:
+        for old_idx, new_idx in pair_by_key(old_left, new_left, key):
+            pairs.append((old_left.pop(old_idx), new_left.pop(new_idx)))
+
+    if logger is not None:
+        for project in old_left.values():
+            logger.warning("Not changing headers for %s: no single project in "
+                           "the new config matches it (use --rename if it "
+                           "was renamed)", section_title(project))
+    return pairs
+
+
+def pair_subsections(old_project, new_project, logger=None):
+    """Returns a list of (old name, new name) pairs of subsections.
+
+    Subsections are paired by name, and any that remain by position if the
+    same number remain in each project. Otherwise the remaining old
+    subsections are reported (if a logger is passed) and left out.
+    """
+    old_left = dict(enumerate(sub['name'] for sub in
+                              old_project.get('subsections', [])))
+    new_left = dict(enumerate(sub['name'] for sub in
+                              new_project.get('subsections', [])))
+    pairs = []
+    for old_idx, new_idx in pair_by_key(old_left, new_left, lambda name: name):
+        pairs.append((old_left.pop(old_idx), new_left.pop(new_idx)))
+    if len(old_left) == len(new_left):
+        pairs.extend(zip(old_left.values(), new_left.values()))
+    elif logger is not None:
+        for name in old_left.values():
+            logger.warning("Not changing subsection %s of %s: it has no "
+                           "single match in the new config", name,
+                           section_title(old_project))
+    return pairs
+
+
+def build_mapping(old_projects, new_projects, renames=None, logger=None):
+    """Returns the mapping of old headers to new headers for changed projects.
+
+    Projects are paired with pair_projects(), and their subsections with
+    pair_subsections(). The mapping is a dictionary with keys:
+
+    - section:    {old \\section title: new title}
+    - subsection: {old \\subsection title: new title}
+    - heading:    {old comment heading: (new heading, old rule, new rule)}
+
+    Only headers that change are included. A header that would map to more
+    than one new header is reported (if a logger is passed) and left alone.
+    """
+    pairs = {'section': [], 'subsection': [], 'heading': []}
+    for old, new in pair_projects(old_projects, new_projects, renames,
+                                  logger):
+        pairs['section'].append((section_title(old), section_title(new)))
+        old_heading, old_rule = comment_heading(old)
+        new_heading, new_rule = comment_heading(new)
+        pairs['heading'].append((old_heading, (new_heading, old_rule,
+                                               new_rule)))
+        for old_sub, new_sub in pair_subsections(old, new, logger):
+            pairs['subsection'].append((old_sub, new_sub))
+            old_heading, old_rule = subsection_heading(old_sub)
+            new_heading, new_rule = subsection_heading(new_sub)
+            pairs['heading'].append((old_heading, (new_heading, old_rule,
+                                                   new_rule)))
+
+    mapping = {}
+    for kind, kpairs in pairs.items():
+        targets = {}
+        for old, new in kpairs:
+            targets.setdefault(old, set()).add(new)
+        mapping[kind] = {}
+        for old, news in targets.items():
+            if len(news) > 1:
+                if logger is not None:
+                    logger.warning("Not changing %s header %s: it maps to " +
+                                   "more than one new header", kind, old)
+                continue
+            new = news.pop()
+            changed = new[0] != old if kind == 'heading' else new != old
+            if changed:
+                mapping[kind][old] = new
+    return mapping
+
+
+def title_regex(titles, command):
+    """Returns a regex matching any of titles in \\<command>{<title>:.
+
+    Returns None if there are no titles.
+    """
+    if not titles:
+        return None
+    alternatives = '|'.join(re.escape(title) for title in
+                            sorted(titles, key=len, reverse=True))
+    return re.compile(r'(\\%s\{\s*)(%s)(\s*:)' % (command, alternatives))
+
+
+def retemplate_text(text, mapping):
+    """Returns text with old headers replaced by new headers from mapping."""
+    for kind in ('section', 'subsection'):
+        regex = title_regex(mapping[kind], kind)
+        if regex is not None:
+            text = regex.sub(lambda m: m.group(1) + mapping[kind][m.group(2)] +
+                             m.group(3), text)
+    if mapping['heading']:
+        lines = text.split('\n')
+        for idx, line in enumerate(lines):
+            if line.rstrip() not in mapping['heading']:
+                continue
+            new_heading, old_rule, new_rule = mapping['heading'][line.rstrip()]
+            eol = '\r' if line.endswith('\r') else ''  # Keep CRLF endings
+            lines[idx] = new_heading + eol
+            if idx + 1 < len(lines) and lines[idx + 1].rstrip() == old_rule:
+                lines[idx + 1] = new_rule + eol
+        text = '\n'.join(lines)
+    return text
+
+
+def retemplate_file(path, mapping, dry_run=False):
+    """Rewrite the headers in a lab book, according to mapping.
+
+    The lab book is replaced atomically, and only if a header changes.
+    Returns a unified diff of the changes, which is empty if the lab book
+    doesn't contain any changed headers. If dry_run is True, the lab book is
+    not rewritten.
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as ifh:
+        text = ifh.read()
+    newtext = retemplate_text(text, mapping)
+    if newtext == text:
+        return ''
+    diff = ''.join(difflib.unified_diff(text.splitlines(True),
+                                        newtext.splitlines(True),
+                                        path, path))
+    if not dry_run:
+        tmpfd, tmppath = tempfile.mkstemp(suffix='.tex',
+                                          dir=os.path.dirname(path) or '.')
+        try:
+            with os.fdopen(tmpfd, 'w', encoding='utf-8', newline='') as ofh:
+                ofh.write(newtext)
+            shutil.copymode(path, tmppath)
+            os.replace(tmppath, path)
+        except BaseException:
+            os.remove(tmppath)
+            raise
+    return diff
+
+
+def try_retemplate_file(path, mapping, dry_run=False):
+    """Returns (diff, error) from calling retemplate_file().
+
+    error is None if the lab book was processed, or a description of why it
+    could not be (e.g. it is not valid UTF-8), in which case it is left
+    unchanged and diff is empty.
+    """
+    try:
+        return retemplate_file(path, mapping, dry_run), None
+    except (OSError, UnicodeDecodeError) as err:
+        return '', '%s: %s' % (type(err).__name__, err)
+
+
+def retemplate_files(paths, mapping, dry_run=False, workers=None):
+    """Rewrite the headers in lab books in parallel, according to mapping.
+
+    Lab books are processed in a pool of workers processes. Yields
+    (path, diff, error) for each lab book, in the order passed, as from
+    try_retemplate_file(); a lab book that can't be processed doesn't stop
+    the others.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, (diff, error) in zip(
+                paths, executor.map(try_retemplate_file, paths,
+                                    [mapping] * len(paths),
+                                    [dry_run] * len(paths), chunksize=16)):
+            yield path, diff, error
@@ -5,6 +5,11 @@
 Provides subcommand functions for the pdp.py script
 
 - make_blank:        generate new blank lab book
+- timesheet:         report time recorded in lab books
+- pack:              pack lab books into a single archive
+- assets:            deduplicate and check lab book graphics
+- retemplate:        update lab book headers after YAML config changes
+- occupancy:         tabulate when in the day time is recorded
 
 (c) The James Hutton Institute 2017
 Author: Leighton Pritchard
@@ -44,12 +49,16 @@ THE SOFTWARE.
 """
 
 import os
+import sys
 
 from datetime import date
 
 import iso8601
 import yaml
 
+from . import archives, assets, occupancy, retemplate, timesheet, topics
+from .ledger import TimeLedger
+
 titlestr = """\n\n
 %% SET TITLE HERE
 %%%%%%%%%%%%%%%%%
@@ -234,6 +243,318 @@ def subcmd_make_blank(args, logger):
     return 0
 
 
+def subcmd_timesheet(args, logger):
+    """Run `timesheet` subcommand operations.
+    """
+    # Check that the input paths exist
+    for path in args.paths:
+        if not os.path.exists(path):
+            logger.error("Input path %s does not exist (exiting)", path)
+            raise SystemExit(1)
+
+    # Scrape the lab books. If we need to compare time ranges, scrape them
+    # once and derive the time spent from them
+    if args.conflicts or args.wallclock:
+        intervals = timesheet.process_labbooks(args.paths,
+                                               timesheet.scrape_intervals,
+                                               logger, args.searchpaths)
+        times = timesheet.intervals_to_times(intervals)
+    else:
+        times = timesheet.process_labbooks(args.paths, logger=logger,
+                                           searchpaths=args.searchpaths)
+    logger.info("Scraped %d lab books", len(times))
+
+    # Index canonical topic names from the YAML config, if provided
+    normalise = None
+    if args.yamlfile is not None:
+        logger.info("Normalising topics to names in %s", args.yamlfile)
+        try:
+            topic_index = topics.TopicIndex.from_yamlfile(args.yamlfile,
+                                                          args.min_similarity)
+        except (OSError, yaml.YAMLError):
+            logger.error("Could not load YAML config %s (exiting)",
+                         args.yamlfile)
+            raise SystemExit(1)
+        normalise = topic_index.normalise
+
+    # Write tabular output, if requested
+    if args.tabular:
+        outpath = args.outfilename or 'timedump.tab'
+        logger.info("Writing time to %s", outpath)
+        time_df = timesheet.times_to_df(times, logger)
+        time_df.to_csv(outpath, sep='\t', header=True, index=False)
+        return 0
+
+    # Write reports to the output file, or STDOUT
+    if args.outfilename is None:
+        logger.info("Using stdout for output")
+        ofh = sys.stdout
+    else:
+        logger.info("Using %s for output", args.outfilename)
+        try:
+            ofh = open(args.outfilename, 'w')
+        except OSError:
+            logger.error("Could not open output file %s (exiting)",
+                         args.outfilename)
+            raise SystemExit(1)
+    ledger = TimeLedger.from_times(times)
+    logger.info("Reporting time by day")
+    timesheet.report_by_day(ledger, ofh)
+    if args.conflicts:
+        logger.info("Reporting overlapping and unrecorded time")
+        timesheet.report_conflicts(intervals, ofh)
+    if args.wallclock:
+        timesheet.report_total_time(ledger, ofh,
+                                    timesheet.wallclock_time(intervals),
+                                    normalise)
+    else:
+        timesheet.report_total_time(ledger, ofh, normalise=normalise)
+    if normalise is not None:
+        for topic, canonical in topic_index.remapped():
+            logger.warning("Totalled topic %s under %s", topic, canonical)
+    if ofh is not sys.stdout:
+        ofh.close()
+
+    return 0
+
+
+def subcmd_pack(args, logger):
+    """Run `pack` subcommand operations.
+    """
+    # Check the input directory exists
+    if not os.path.isdir(args.indirname):
+        logger.error("Input path %s is not a directory (exiting)",
+                     args.indirname)
+        raise SystemExit(1)
+
+    # Identify the output archive, and don't overwrite it unless asked
+    if args.outfilename is None:
+        outpath = os.path.normpath(args.indirname) + '.zip'
+    else:
+        outpath = args.outfilename
+    if not archives.is_archive(outpath):
+        logger.error("Output archive %s must end in .zip (exiting)", outpath)
+        raise SystemExit(1)
+    if os.path.exists(outpath) and not args.force:
+        logger.error("%s exists. Will not overwrite (exiting)", outpath)
+        raise SystemExit(1)
+
+    # Pack the lab books
+    logger.info("Packing lab books from %s into %s", args.indirname, outpath)
+    texfiles = archives.pack_labbooks(args.indirname, outpath, logger)
+    logger.info("Packed %d lab books", len(texfiles))
+
+    # Remove the packed sources, if requested
+    if args.remove:
+        for texfile in texfiles:
+            logger.info("Removing %s", texfile)
+            os.remove(texfile)
+    else:
+        logger.warning("Kept %d packed lab books in %s: scans that find " +
+                       "both will read %s and skip them", len(texfiles),
+                       args.indirname, outpath)
+
+    return 0
+
+
+def subcmd_assets(args, logger):
+    """Run `assets` subcommand operations.
+    """
+    # Check the input directory exists
+    if not os.path.isdir(args.indirname):
+        logger.error("Input path %s is not a directory (exiting)",
+                     args.indirname)
+        raise SystemExit(1)
+    if args.storedir is None:
+        storedir = os.path.join(args.indirname, '.assets')
+    else:
+        storedir = args.storedir
+    logger.info("Using asset store %s", storedir)
+
+    # Find and hash the graphics
+    graphics_dirs = assets.find_graphics_dirs(args.indirname,
+                                              args.graphics_dirname)
+    logger.info("Found %d graphics directories", len(graphics_dirs))
+    assetfiles = assets.find_assets(graphics_dirs)
+    paths = [path for dirpaths in assetfiles.values() for path in dirpaths]
+    index = assets.load_index(storedir)
+
+    # Find stored copies that have been edited in place since they were
+    # deduplicated, and take them out of the store so that no more files are
+    # linked to them
+    for objpath in assets.verify_store(storedir, index, args.workers,
+                                       logger):
+        logger.warning("Stored graphic %s no longer matches its digest: a " +
+                       "linked copy was edited in place, which changed it " +
+                       "in every lab book that links to it", objpath)
+        if not args.dry_run:
+            logger.warning("Removing %s from the store", objpath)
+            os.remove(objpath)
+            index.pop(os.path.abspath(objpath), None)
+
+    digests = assets.hash_assets(paths, index, args.workers, logger)
+    duplicates = assets.group_duplicates(digests)
+    dupsize = assets.duplicate_size(duplicates)
+    sys.stdout.write("Graphics files: %d in %d directories\n" %
+                     (len(paths), len(graphics_dirs)))
+    sys.stdout.write("Distinct contents: %d\n" % len(set(digests.values())))
+    sys.stdout.write("Duplicated contents: %d (%.2fMB in extra copies)\n" %
+                     (len(duplicates), dupsize / 2 ** 20))
+
+    # Replace duplicates with hardlinks to the store
+    if args.dedup:
+        replaced, saved = assets.dedup_assets(digests, storedir, index,
+                                              args.dry_run, logger)
+        sys.stdout.write("%s %d files with links to the store (%.2fMB)\n" %
+                         ("Would replace" if args.dry_run else "Replaced",
+                          replaced, saved / 2 ** 20))
+
+    # Keep the hashes for the next run
+    if not args.dry_run:
+        assets.save_index(storedir, index)
+
+    # Report graphics that no lab book includes
+    if args.unused:
+        texfiles = timesheet.find_labbooks(args.indirname)
+        logger.info("Checking \\includegraphics in %d lab books",
+                    len(texfiles))
+        references = assets.find_graphics_references(texfiles)
+        unused = assets.find_unused(assetfiles, references)
+        sys.stdout.write("Unused graphics: %d\n" % len(unused))
+        for path in unused:
+            sys.stdout.write("\t%s\n" % path)
+
+    return 0
+
+
+def subcmd_retemplate(args, logger):
+    """Run `retemplate` subcommand operations.
+    """
+    # Load projects from the old and new YAML configs, and work out which
+    # headers have changed
+    yamlpath = get_yamlfile(args)
+    logger.info("Updating headers from %s to %s", args.old_yamlfile,
+                yamlpath)
+    try:
+        mapping = retemplate.build_mapping(
+            retemplate.load_projects(args.old_yamlfile),
+            retemplate.load_projects(yamlpath),
+            retemplate.parse_renames(args.renames), logger)
+    except (OSError, yaml.YAMLError):
+        logger.error("Could not load YAML configs (exiting)")
+        raise SystemExit(1)
+    except ValueError as err:
+        logger.error("%s (exiting)", err)
+        raise SystemExit(1)
+    nchanges = sum(len(changes) for changes in mapping.values())
+    logger.info("%d headers have changed", nchanges)
+    if not nchanges:
+        return 0
+
+    # Find lab books to rewrite. Archives are left alone: they hold lab
+    # books that are no longer edited
+    texfiles = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            texfiles.extend(f for f in archives.find_texfiles(path)[0]
+                            if f.endswith('.tex'))
+        elif os.path.isfile(path):
+            texfiles.append(path)
+        else:
+            logger.error("Input path %s does not exist (exiting)", path)
+            raise SystemExit(1)
+
+    # Rewrite the lab books. Lab books that can't be read or rewritten are
+    # skipped, and reported
+    changed, skipped = 0, 0
+    for path, diff, error in retemplate.retemplate_files(texfiles, mapping,
+                                                         args.dry_run,
+                                                         args.workers):
+        if error is not None:
+            skipped += 1
+            logger.warning("Skipped %s (%s)", path, error)
+        elif diff:
+            changed += 1
+            logger.info("%s %s", "Would rewrite" if args.dry_run else
+                        "Rewrote", path)
+            if args.dry_run:
+                sys.stdout.write(diff)
+    logger.info("%s %d of %d lab books", "Would rewrite" if args.dry_run
+                else "Rewrote", changed, len(texfiles))
+    if skipped:
+        logger.warning("Skipped %d lab books that could not be rewritten",
+                       skipped)
+
+    return 0
+
+
+def subcmd_occupancy(args, logger):
+    """Run `occupancy` subcommand operations.
+    """
+    # Check that the input paths exist
+    for path in args.paths:
+        if not os.path.exists(path):
+            logger.error("Input path %s does not exist (exiting)", path)
+            raise SystemExit(1)
+
+    # Check the bin size before scraping anything
+    try:
+        occupancy.check_binsize(args.binsize)
+    except ValueError as err:
+        logger.error("%s (exiting)", err)
+        raise SystemExit(1)
+
+    # Get the date window, if any
+    try:
+        start, end = [None if val is None else
+                      iso8601.parse_date(val).date()
+                      for val in (args.start, args.end)]
+    except iso8601.ParseError:
+        logger.error("Could not parse dates %s, %s (exiting)", args.start,
+                     args.end)
+        raise SystemExit(1)
+
+    # Index canonical topic names from the YAML config, if provided
+    normalise = None
+    if args.yamlfile is not None:
+        logger.info("Normalising topics to names in %s", args.yamlfile)
+        try:
+            topic_index = topics.TopicIndex.from_yamlfile(args.yamlfile,
+                                                          args.min_similarity)
+        except (OSError, yaml.YAMLError):
+            logger.error("Could not load YAML config %s (exiting)",
+                         args.yamlfile)
+            raise SystemExit(1)
+        normalise = topic_index.normalise
+
+    # Scrape time ranges, and tabulate them
+    intervals = timesheet.process_labbooks(args.paths,
+                                           timesheet.scrape_intervals,
+                                           logger, args.searchpaths)
+    logger.info("Tabulating occupancy by %s for %d lab books", args.by,
+                len(intervals))
+    try:
+        table = occupancy.occupancy_table(intervals, args.by, start, end,
+                                          args.binsize, normalise)
+    except ValueError as err:
+        logger.error("%s (exiting)", err)
+        raise SystemExit(1)
+
+    if normalise is not None:
+        for topic, canonical in topic_index.remapped():
+            logger.warning("Grouped topic %s under %s", topic, canonical)
+
+    # Write the table to the output file, or STDOUT
+    if args.outfilename is None:
+        occupancy.write_table(*table, sys.stdout, by=args.by)
+    else:
+        logger.info("Writing occupancy table to %s", args.outfilename)
+        with open(args.outfilename, 'w') as ofh:
+            occupancy.write_table(*table, ofh, by=args.by)
+
+    return 0
+
+
 # Build a header for a passed project
 def build_project_header(project):
     """Returns LaTeX header for passed project info (from YAML)
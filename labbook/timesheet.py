@@ -0,0 +1,636 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""timesheet.py
+
+Provides functions to scrape and report time recorded in lab books
+
+Time is recorded under \\section{} and \\subsection{} headers in the format:
+
+SUBJECT: HHMM-HHMM; HHMM-HHMM;...
+
+These functions take explicit arguments, so that lab books can be scraped
+once and reported on many times within a single process.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact: leighton.pritchard@hutton.ac.uk
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import logging
+import os
+import re
+
+from collections import defaultdict
+from datetime import date
+
+from . import archives
+from .ledger import TimeLedger
+
+
+# Default logger, for when the caller doesn't provide one
+LOGGER = logging.getLogger(__name__)
+
+# Parsed .tex files, keyed by absolute path. Each value is a tuple of
+# (mtime, [(kind, value), ...]) where kind is "section" for a time-recording
+# header, or "input" for an \\input{} or \\include{} target, in the order
+# they appear in the file. Shared fragments are parsed once, however many lab
+# books include them, and reparsed only if they are modified.
+FRAGMENT_CACHE = {}
+
+
+# Return paths to .tex files from a list of files and directories
+def find_labbooks(paths):
+    """ Returns a list of paths to .tex files.
+
+        Each element of paths may be a .tex (or .tex.gz) file, a .zip archive
+        of lab books, or a directory. Directories are traversed, and all .tex
+        files beneath them are returned, including those in archives. Files
+        in archives are returned as paths through the archive (see
+        labbook.archives).
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    texfiles = []
+    for path in paths:
+        if archives.is_archive(path) and os.path.isfile(path):
+            texfiles.extend(archives.list_archive(path))
+        elif not os.path.isdir(path):
+            texfiles.append(path)
+        else:
+            dirfiles, dirarchives = archives.find_texfiles(path)
+            texfiles.extend(dirfiles)
+            for archive in dirarchives:
+                texfiles.extend(archives.list_archive(archive))
+    return texfiles
+
+
+# Return the lab book name (YYYY-MM-DD.tex) for a path
+def labbook_name(path):
+    """ Returns the filename of a lab book, without any .gz extension
+    """
+    filename = os.path.split(path)[-1]
+    if filename.lower().endswith(".gz"):
+        filename = filename[:-3]
+    return filename
+
+
+def labbook_ordinal(filename):
+    """ Returns the date ordinal of a lab book named YYYY-MM-DD.tex, or 0 if
+        the lab book isn't named for a date
+    """
+    try:
+        return date.fromisoformat(os.path.splitext(filename)[0]).toordinal()
+    except ValueError:
+        return 0
+
+
+# Traverse subdirectories, collecting .tex files and processing the headers
+def process_labbooks(paths, scraper=None, logger=None, searchpaths=None,
+                     cache=None):
+    """ Starting from the input files and directories, traverse all
+        subdirectories, finding .tex files. Process each .tex file to find
+        time spent under each heading, and collate.
+
+        Each file is processed with scraper (default: scrape_time), following
+        \\input{} and \\include{} into fragments (see expand_fragments()).
+        Files that are included by another lab book are not processed in
+        their own right, so their time is not counted twice. Nor are lab
+        books that have also been packed into an archive (see
+        drop_duplicate_labbooks()).
+    """
+    if scraper is None:
+        scraper = scrape_time
+    # Traverse subdirectories and get list of lab book locations
+    texfiles = find_labbooks(paths)
+
+    # Drop fragments included by other lab books. The parsed files are
+    # memoised, so scraping them below doesn't read them again
+    included = included_fragments(texfiles, searchpaths, cache, logger)
+    texfiles = [f for f in texfiles if os.path.abspath(f) not in included]
+    texfiles = drop_duplicate_labbooks(texfiles, logger)
+
+    # Process each book, returning a list of tuples:
+    # (filename, [(activity, minutes)]) for scrape_time, or
+    # (filename, [(activity, [(start, end)])]) for scrape_intervals
+    return [
+        (labbook_name(texfile), scraper(texfile, logger, searchpaths, cache))
+        for texfile in texfiles
+    ]
+
+
+# Drop lab books that are also in an archive, and warn about other duplicates
+def drop_duplicate_labbooks(texfiles, logger=None):
+    """ Returns texfiles without the lab books that have the same name as a
+        lab book in an archive, e.g. because a year was packed without
+        removing its sources. The archived copy is kept, and each dropped
+        file is reported as a warning. Any other lab book name that is
+        still found more than once is also reported, as its time will be
+        combined in reports.
+    """
+    if logger is None:
+        logger = LOGGER
+    packed = {}
+    for texfile in texfiles:
+        if archives.split_archive_path(texfile)[0] is not None:
+            packed.setdefault(labbook_name(texfile), texfile)
+    kept, paths = [], defaultdict(list)
+    for texfile in texfiles:
+        name = labbook_name(texfile)
+        if name in packed and packed[name] != texfile and \
+           archives.split_archive_path(texfile)[0] is None:
+            logger.warning("Skipping %s: already read from %s", texfile,
+                           packed[name])
+            continue
+        kept.append(texfile)
+        paths[name].append(texfile)
+    for name, npaths in sorted(paths.items()):
+        if len(npaths) > 1:
+            logger.warning("Lab book %s found %d times, and will be " +
+                           "reported as one day: %s", name, len(npaths),
+                           ", ".join(npaths))
+    return kept
+
+
+# Report time spent by lab book day
+def report_by_day(times, outstream):
+    """ Report time spent by lab book day
+
+        times may be the output of process_labbooks(), or a TimeLedger
+    """
+    if not isinstance(times, TimeLedger):
+        times = TimeLedger.from_times(times)
+    days, bounds, topics, minutes = times.total_by_day_topic()
+    # Each distinct topic and time is formatted once, not once per row
+    labels = {topic: "\t%30s:\t" % topic for topic in set(topics)}
+    hours = {t: "%.2fh\n" % (t / 60.) for t in set(minutes)}
+    rows = [labels[topic] + hours[t] for topic, t in zip(topics, minutes)]
+    lines = []
+    for idx, filename in enumerate(days):
+        start, end = bounds[idx], bounds[idx + 1]
+        lines.append("\n%s:\n%sTotal time recorded: %.2fh\n" %
+                     (filename, "".join(rows[start:end]),
+                      sum(minutes[start:end]) / 60.))
+    outstream.write("".join(lines))
+
+
+# Report total time recorded in lab boo
+def report_total_time(times, outstream, wallclock=None, normalise=None):
+    """ Report time recorded across all lab books
+
+        times may be the output of process_labbooks(), or a TimeLedger
+
+        If wallclock (total minutes with overlapping time counted once) is
+        passed, this is reported alongside the recorded total
+
+        If normalise is passed, it is called on each topic to give the name
+        its time is totalled under (e.g. labbook.topics.TopicIndex.normalise)
+    """
+    if not isinstance(times, TimeLedger):
+        times = TimeLedger.from_times(times)
+    if normalise is None:
+        key = str.upper
+    else:
+        key = lambda topic: normalise(topic).upper()
+    totals = times.total_by_topic(key)
+    days = len(times.days)
+    outstream.write("\nTotal time recorded:\n")
+    total = sum(totals.values())
+    for topic, t in sorted(totals.items()):
+        outstream.write(
+            "\t%30s:\t%dh%dm\t%.2fh\t(%.2f%%)\n"
+            % (topic, (t - t % 60) / 60, t % 60, t / 60., 100. * t / total)
+        )
+    if total:
+        outstream.write(
+            "Total time recorded: %dh%dm\t%.2fh\n"
+            % ((total - total % 60) / 60, total % 60, total / 60.)
+        )
+        outstream.write(
+            "Total time recorded per lab book: %dh%dm\t%.2fh\n"
+            % (
+                ((total - total % 60) / 60) / days,
+                (total % 60) / days,
+                total / 60. / days,
+            )
+        )
+    if total and wallclock is not None:
+        outstream.write(
+            "Wall-clock time recorded (overlaps removed): %dh%dm\t%.2fh\n"
+            % ((wallclock - wallclock % 60) / 60, wallclock % 60, wallclock / 60.)
+        )
+
+
+# Report overlapping and unrecorded time within each lab book day
+def report_conflicts(intervals, outstream):
+    """ Report overlapping time ranges and gaps between recorded time for
+        each lab book day, with a summary across all lab books
+    """
+    days = intervals_by_day(intervals)
+    outstream.write("\nOverlapping and unrecorded time:\n")
+    doubled, conflict_days = 0, 0
+    for filename, ranges in sorted(days.items()):
+        merged, overlaps, gaps, day_doubled = merge_intervals(ranges)
+        daytime = sum(end - start for start, end in merged)
+        recorded = daytime + day_doubled
+        doubled += day_doubled
+        if not (overlaps or gaps):
+            continue
+        outstream.write("\n%s:\n" % filename)
+        for first, second, overlap in overlaps:
+            outstream.write(
+                "\tOVERLAP\t%s-%s %s / %s-%s %s\t(%dm)\n"
+                % (
+                    format_minutes(first[0]),
+                    format_minutes(first[1]),
+                    first[2],
+                    format_minutes(second[0]),
+                    format_minutes(second[1]),
+                    second[2],
+                    overlap,
+                )
+            )
+        for start, end in gaps:
+            outstream.write(
+                "\tGAP\t%s-%s\t(%dm)\n"
+                % (format_minutes(start), format_minutes(end), end - start)
+            )
+        if overlaps:
+            conflict_days += 1
+        outstream.write(
+            "Recorded: %.2fh\tWall-clock: %.2fh\n" % (recorded / 60., daytime / 60.)
+        )
+    outstream.write(
+        "\nDays with overlapping time: %d of %d\n" % (conflict_days, len(days))
+    )
+    outstream.write(
+        "Time counted more than once: %dh%dm\t%.2fh\n"
+        % ((doubled - doubled % 60) / 60, doubled % 60, doubled / 60.)
+    )
+
+
+# Takes an iterable of .tex files and processes \section and \subsection
+# headers to scrape times spent under the header
+def scrape_time(filename, logger=None, searchpaths=None, cache=None):
+    """ Loops over a .tex file and scrapes the
+        time spent (in format HHMM-HHMM) from each \\section and \\subsection
+        header.
+
+        The time ranges are those from scrape_intervals(), so invalid ranges
+        are dropped in the same way.
+    """
+    # Process matches into subject, time values
+    return [
+        (topic, sum(end - start for start, end in ranges))
+        for topic, ranges in scrape_intervals(filename, logger, searchpaths,
+                                              cache)
+    ]
+
+
+# Takes a .tex file and processes \section and \subsection headers to scrape
+# the time ranges recorded under the header
+def scrape_intervals(filename, logger=None, searchpaths=None, cache=None):
+    """ Loops over a .tex file and scrapes the time ranges (in format
+        HHMM-HHMM) from each \\section and \\subsection header, as
+        (start, end) minutes since midnight.
+
+        Ranges that aren't valid_interval()s are reported (if a logger is
+        passed) and dropped.
+    """
+    intervals = []
+    for m in scrape_headers(filename, logger, searchpaths, cache):
+        topic, ranges = process_match_intervals(m)
+        valid = [r for r in ranges if valid_interval(*r)]
+        if logger is not None and len(valid) < len(ranges):
+            for start, end in set(ranges).difference(valid):
+                logger.warning("Skipping invalid time range %02d%02d-%s "
+                               "under %s in %s", *divmod(start, 60),
+                               format_minutes(end), topic, filename)
+        intervals.append((topic, valid))
+    return intervals
+
+
+# Returns the \section and \subsection headers that record time in a .tex file
+def scrape_headers(filename, logger=None, searchpaths=None, cache=None):
+    """ Returns the contents of each \\section and \\subsection header in a
+        .tex file that has the form TOPIC: ..., including those in fragments
+        pulled in with \\input{} or \\include{}
+    """
+    if logger is None:
+        logger = LOGGER
+    logger.info("Scraping %s", filename)
+    return expand_fragments(filename, searchpaths, cache, logger)[0]
+
+
+# Follow \input{} and \include{} to collect headers from a .tex file and the
+# fragments it includes
+def expand_fragments(filename, searchpaths=None, cache=None, logger=None):
+    """ Returns a tuple of (HEADERS, FRAGMENTS) for a .tex file, where HEADERS
+        are the time-recording \\section and \\subsection headers in the file
+        and everything it includes (in document order), and FRAGMENTS is the
+        set of absolute paths to included files.
+
+        Included files are looked for relative to the including file, then in
+        each of searchpaths. Each file is parsed once, and memoised in cache
+        (default: FRAGMENT_CACHE) by path and modification time. An include
+        that would re-enter a file already being expanded is reported and
+        skipped.
+    """
+    if logger is None:
+        logger = LOGGER
+    headers, fragments = [], set()
+
+    def expand(path, ancestors):
+        for kind, value in parse_fragment(path, cache, logger):
+            if kind == "section":
+                headers.append(value)
+                continue
+            target = resolve_include(value, os.path.dirname(path), searchpaths)
+            if target is None:
+                logger.warning("Could not find %s, included from %s", value, path)
+            elif target in ancestors:
+                logger.warning("Skipping circular include of %s from %s",
+                               target, path)
+            else:
+                fragments.add(target)
+                expand(target, ancestors | {target})
+
+    path = os.path.abspath(filename)
+    expand(path, {path})
+    return headers, fragments
+
+
+# Find every file included by any of a list of .tex files
+def included_fragments(texfiles, searchpaths=None, cache=None, logger=None):
+    """ Returns the set of absolute paths to files that are included, directly
+        or indirectly, by any of the passed .tex files.
+
+        Unlike expand_fragments(), each file is visited only once, and
+        missing or circular includes are not reported.
+    """
+    included = set()
+    queue = [os.path.abspath(f) for f in texfiles]
+    while queue:
+        path = queue.pop()
+        for kind, value in parse_fragment(path, cache, logger):
+            if kind != "input":
+                continue
+            target = resolve_include(value, os.path.dirname(path), searchpaths)
+            if target is not None and target not in included:
+                included.add(target)
+                queue.append(target)
+    return included
+
+
+# Parse a single .tex file, with memoisation
+def parse_fragment(path, cache=None, logger=None):
+    """ Returns a list of (KIND, VALUE) tuples for the time-recording headers
+        (KIND "section") and uncommented \\input{}/\\include{} targets (KIND
+        "input") in the .tex file at path, in the order they appear.
+
+        Results are memoised in cache (default: FRAGMENT_CACHE), and the file
+        is only read again if its modification time changes.
+    """
+    if cache is None:
+        cache = FRAGMENT_CACHE
+    mtime = archives.get_mtime(path)
+    if path in cache and cache[path][0] == mtime:
+        return cache[path][1]
+
+    section_re = re.compile(r"((?<=\\section\{).*(?=\}))")
+    comment_re = re.compile(r"(?<!\\)%.*")
+    input_re = re.compile(r"\\(?:input|include)\{([^}]+)\}")
+    if logger is not None:
+        logger.info("Parsing %s", path)
+    items = []
+    for line in archives.read_text(path).splitlines():
+        # Get \section{} and \subsection{} elements
+        items.extend(
+            ("section", m)
+            for m in section_re.findall(line)
+            if len(m.strip()) and ":" in m
+        )
+        # Get \input{} and \include{} targets that aren't commented out
+        items.extend(
+            ("input", m.strip())
+            for m in input_re.findall(comment_re.sub("", line))
+        )
+    cache[path] = (mtime, items)
+    return items
+
+
+# Find the file named by an \input{} or \include{}
+def resolve_include(name, basedir, searchpaths=None):
+    """ Returns the absolute path to the file named in an \\input{} or
+        \\include{}, or None if it can't be found.
+
+        As in LaTeX, the name may omit the .tex extension, and gzipped
+        (.tex.gz) files are also found. The file is looked for relative to
+        basedir (which may be inside an archive), then in each of
+        searchpaths, in order.
+    """
+    candidates = [name]
+    if os.path.splitext(name)[-1] != ".tex":
+        candidates.append(name + ".tex")
+    candidates.extend([c + ".gz" for c in candidates if c.endswith(".tex")])
+    for dirname in [basedir] + list(searchpaths or []):
+        for candidate in candidates:
+            path = os.path.join(dirname, os.path.expanduser(candidate))
+            if archives.isfile(path):
+                return os.path.abspath(path)
+    return None
+
+
+# Convert the section/subsection headers into a topic name and time spent
+def process_match(match):
+    """ Takes a string regex match for a (sub)section header of format:
+        TOPIC: HHMM-HHMM; HHMM-HHMM...
+        and returns a tuple of (TOPIC, TIME SPENT IN MINUTES)
+    """
+    time_re = "[0-9]{4}-[0-9]{4}"
+    topic, times = match.split(":", 1)
+    topic = topic.strip()
+    times = re.findall(time_re, times)
+    if not len(times):
+        return (topic, 0)
+    return (topic, calc_time(times))
+
+
+# Convert the section/subsection headers into a topic name and time ranges
+def process_match_intervals(match):
+    """ Takes a string regex match for a (sub)section header of format:
+        TOPIC: HHMM-HHMM; HHMM-HHMM...
+        and returns a tuple of (TOPIC, [(START, END), ...]) in minutes since
+        midnight
+    """
+    time_re = "[0-9]{4}-[0-9]{4}"
+    topic, times = match.split(":", 1)
+    return (topic.strip(), [parse_interval(t) for t in re.findall(time_re, times)])
+
+
+# Convert string times HHMM-HHMM into time spent
+def calc_time(times):
+    """ Takes a list of times in HHMM-HHMM format, and returns the difference
+        between the first and second times
+    """
+    cumt = 0
+    for t in times:
+        t1, t2 = t.split("-")
+        tm = (int(t2[2:]) - int(t1[2:])) % 60
+        th = 60 * ((int(t2[:2]) - int(t1[:2])) % 24)
+        if int(t2[2:]) < int(t1[2:]):
+            th -= 60
+        cumt += tm + th
+    return cumt
+
+
+# Convert a string time HHMM-HHMM into start and end minutes
+def parse_interval(trange):
+    """ Takes a time in HHMM-HHMM format, and returns a tuple of (START, END)
+        in minutes since midnight. Ranges that run past midnight end after
+        1440, so that END - START always agrees with calc_time()
+    """
+    t1 = trange.split("-")[0]
+    start = 60 * int(t1[:2]) + int(t1[2:])
+    return (start, start + calc_time([trange]))
+
+
+# Check that a time range from parse_interval() is a valid range of time
+def valid_interval(start, end):
+    """ Returns True if a (START, END) time range starts within the day
+        (before 2400), and doesn't end before it starts
+    """
+    return 0 <= start < 1440 and start <= end
+
+
+# Convert minutes since midnight into a HHMM string
+def format_minutes(minutes):
+    """ Returns minutes since midnight in HHMM format
+    """
+    return "%02d%02d" % divmod(minutes % 1440, 60)
+
+
+# Find overlaps and gaps in the time ranges recorded for a day
+def merge_intervals(intervals):
+    """ Takes a list of (START, END, TOPIC) time ranges for a single day, and
+        returns a tuple of (MERGED, OVERLAPS, GAPS, DOUBLED), where:
+
+        MERGED   - sorted, non-overlapping [START, END] blocks of recorded time
+        OVERLAPS - ((START, END, TOPIC), (START, END, TOPIC), MINUTES) for each
+                   range that starts before an earlier range has finished
+        GAPS     - (START, END) unrecorded time between merged blocks
+        DOUBLED  - minutes of the ranges that were already covered by an
+                   earlier range, i.e. counted more than once
+
+        The ranges are sorted once and merged in a single sweep, so this is
+        O(n log n) in the number of ranges. Empty ranges, and ranges that end
+        before they start, are ignored.
+    """
+    merged, overlaps, gaps = [], [], []
+    doubled = 0
+    reach = None  # The earlier range that finishes latest
+    for interval in sorted(i for i in intervals if i[1] > i[0]):
+        start, end = interval[:2]
+        if reach is not None and start < reach[1]:
+            overlaps.append((reach, interval, min(end, reach[1]) - start))
+        if not merged or start > merged[-1][1]:
+            if merged:
+                gaps.append((merged[-1][1], start))
+            merged.append([start, end])
+        else:
+            doubled += min(end, merged[-1][1]) - start
+            merged[-1][1] = max(merged[-1][1], end)
+        if reach is None or end > reach[1]:
+            reach = interval
+    return merged, overlaps, gaps, doubled
+
+
+# Collect the time ranges scraped from each lab book by day
+def intervals_by_day(intervals):
+    """ Takes the output of process_labbooks(scrape_intervals) and returns a
+        dictionary of [(START, END, TOPIC), ...] time ranges, keyed by lab
+        book filename. Lab books with the same filename are the same day, so
+        all their sections are collected together.
+    """
+    days = defaultdict(list)
+    for filename, ilist in intervals:
+        for topic, ranges in ilist:
+            days[filename].extend((start, end, topic) for start, end in ranges)
+    return days
+
+
+# Calculate time recorded, counting overlapping time only once
+def wallclock_time(intervals):
+    """ Takes the output of process_labbooks(scrape_intervals) and returns the
+        total wall-clock time recorded, in minutes
+    """
+    return sum(
+        end - start
+        for ranges in intervals_by_day(intervals).values()
+        for start, end in merge_intervals(ranges)[0]
+    )
+
+
+# Convert a list of scraped time ranges into time spent
+def intervals_to_times(intervals):
+    """ Takes the output of process_labbooks(scrape_intervals) and returns the
+        equivalent output of process_labbooks(scrape_time)
+    """
+    return [
+        (filename, [(topic, sum(end - start for start, end in ranges))
+                    for topic, ranges in ilist])
+        for filename, ilist in intervals
+    ]
+
+
+# Convert list of time tuples to pandas daraframe
+def times_to_df(times, logger=None):
+    """Returns a long-form dataframe where columns are date, activity, and time
+    """
+    # pandas is slow to import, and only needed for tabular output
+    import pandas as pd
+
+    if logger is None:
+        logger = LOGGER
+    columns = ["date", "activity", "time"]
+    df = pd.DataFrame(columns=columns)
+    index = 0
+    for time in times:
+        date = os.path.splitext(time[0])[0]
+        for activity, time in time[1]:
+            if time != 0:
+                logger.info("%s\t%s\t%s", date, activity, time)
+                df.loc[index] = [str(date).strip(), str(activity).strip(), int(time)]
+                index += 1
+    return df
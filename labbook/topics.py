@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""topics.py
+
+Provides normalisation of scraped lab book topics to canonical names
+
+Headers are typed by hand, so the same topic turns up under variant names
+("Email catchup", "E-mail catch-up"). The canonical names are taken from the
+YAML template's projects and subsections, and indexed by character
+trigrams. Each scraped topic is matched against the index by summing the
+weights of shared trigrams, which only touches the canonical names that
+share a trigram with it rather than comparing every pair of strings, and the
+result is memoised.
+
+Section titles share long boilerplate ("Project Time", "ICS group costs
+Timesheets"), which would otherwise dominate the similarity and move time
+onto the wrong project. So trigrams are weighted by how few canonical names
+contain them, a section title only matches canonical titles with the same
+project code (compared without the code), and the best match must be
+clearly better than the next best.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact: leighton.pritchard@hutton.ac.uk
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import math
+import re
+
+from collections import defaultdict
+
+import yaml
+
+
+# Default minimum weighted Dice similarity for a topic to be matched
+MIN_SIMILARITY = 0.7
+
+# Default minimum lead of the best match over the next best
+MIN_MARGIN = 0.1
+
+# Project code at the start of a section title, e.g. E000275-00
+CODE_REGEX = re.compile(r'^\s*([A-Z][0-9]{6}-[0-9]{2})\s+(.*)$', re.S)
+
+
+def clean_topic(topic):
+    """Returns topic lowercased, with everything but letters and digits
+    removed."""
+    return re.sub(r'[\W_]+', '', topic.lower())
+
+
+def trigrams(topic):
+    """Returns the set of character trigrams in a cleaned topic.
+
+    The topic is padded, so that short topics still have trigrams and the
+    start and end of the topic carry extra weight.
+    """
+    padded = '  %s ' % clean_topic(topic)
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+
+def split_code(topic):
+    """Returns (project code, rest of topic) for a section title.
+
+    Returns (None, topic) if the topic doesn't start with a project code.
+    """
+    match = CODE_REGEX.match(topic)
+    if match is None:
+        return None, topic
+    return match.group(1), match.group(2)
+
+
+def canonical_topics(yamldata):
+    """Returns the canonical topic names from YAML template data.
+
+    These are the topics in the headers written by
+    subcommands.build_project_header(): the section title for each
+    project, and the name of each of its subsections.
+    """
+    topics = []
+    for project in yamldata.get('projects', []):
+        topics.append('{0} {1}, {2}'.format(project['number'],
+                                            project['description'],
+                                            project['name']))
+        for subsect in project.get('subsections', []):
+            topics.append(subsect['name'])
+    # Remove duplicates, keeping the first occurrence
+    return list(dict.fromkeys(topics))
+
+
+class TopicIndex(object):
+    """Trigram index of canonical topic names.
+
+    normalise(topic) returns the canonical name that best matches topic, or
+    topic itself if no canonical name is similar enough.
+    """
+
+    def __init__(self, topics, min_similarity=MIN_SIMILARITY,
+                 min_margin=MIN_MARGIN):
+        self.topics = list(topics)
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.codes = []                 # topic ID -> project code, or None
+        self.index = defaultdict(list)  # trigram -> canonical topic IDs
+        self.memo = {}                  # scraped topic -> normalised topic
+        for topic_id, topic in enumerate(self.topics):
+            code, rest = split_code(topic)
+            self.codes.append(code)
+            for gram in trigrams(rest):
+                self.index[gram].append(topic_id)
+        self.sizes = [0.] * len(self.topics)  # topic ID -> trigram weight
+        for gram, topic_ids in self.index.items():
+            for topic_id in topic_ids:
+                self.sizes[topic_id] += self.weight(gram)
+
+    @classmethod
+    def from_yamlfile(cls, yamlpath, min_similarity=MIN_SIMILARITY,
+                      min_margin=MIN_MARGIN):
+        """Returns a TopicIndex of the canonical topics in a YAML template."""
+        with open(yamlpath) as yfh:
+            yamldata = yaml.safe_load(yfh)
+        return cls(canonical_topics(yamldata), min_similarity, min_margin)
+
+    def weight(self, gram):
+        """Returns the weight of a trigram.
+
+        Trigrams found in fewer canonical topics weigh more, and trigrams
+        found in none weigh the most.
+        """
+        count = len(self.index.get(gram, ())) or 0.5
+        return math.log(1 + len(self.topics) / count)
+
+    def scores(self, topic):
+        """Returns a list of (similarity, canonical topic ID), best first.
+
+        Similarity is the Dice coefficient of the two topics' trigrams,
+        weighted by weight(). Project codes are compared separately: a topic
+        with a project code is only scored against canonical topics with the
+        same code. Only canonical topics sharing a trigram are returned.
+        """
+        code, rest = split_code(topic)
+        grams = trigrams(rest)
+        size = sum(self.weight(gram) for gram in grams)
+        shared = defaultdict(float)
+        for gram in grams:
+            weight = self.weight(gram)
+            for topic_id in self.index.get(gram, ()):
+                if code is None or self.codes[topic_id] == code:
+                    shared[topic_id] += weight
+        return sorted(((2. * total / (size + self.sizes[topic_id]), topic_id)
+                       for topic_id, total in shared.items()),
+                      key=lambda score: (-score[0], score[1]))
+
+    def match(self, topic):
+        """Returns (canonical topic, similarity, margin) for the best match.
+
+        Margin is the lead of the best similarity over the next best.
+        Returns (None, 0, 0) if no canonical topic shares a trigram with
+        topic.
+        """
+        scores = self.scores(topic)
+        if not scores:
+            return None, 0, 0
+        best, topic_id = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0
+        return self.topics[topic_id], best, best - runner_up
+
+    def normalise(self, topic):
+        """Returns the canonical name for topic, memoising the result.
+
+        topic is returned unchanged unless the best match is at least
+        min_similarity alike, and leads the next best by min_margin.
+        """
+        if topic not in self.memo:
+            canonical, score, margin = self.match(topic)
+            if canonical is None or score < self.min_similarity or \
+               margin < self.min_margin:
+                canonical = topic
+            self.memo[topic] = canonical
+        return self.memo[topic]
+
+    def remapped(self):
+        """Returns a sorted list of (topic, canonical topic) for each topic
+        normalise() has mapped to a different name."""
+        return sorted((topic, canonical) for topic, canonical
+                      in self.memo.items() if topic != canonical)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_archives.py
+
+Tests for reading lab books from packed archives
+
+Run with `python -m pytest` from the repository root.
+"""
+
+import logging
+import os
+
+from labbook import archives, timesheet
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def test_packed_labbook_includes_shared_fragment(tmp_path):
+    """A packed lab book still finds a fragment stored outside its archive,
+    through a path that runs back out of the archive with .."""
+    labdir = tmp_path / '2016' / '01' / '2016-01-04'
+    labdir.mkdir(parents=True)
+    (labdir / '2016-01-04.tex').write_text(
+        '\\section{Sequencing: 0900-1000}\n'
+        '\\input{../../../shared/proto}\n')
+    (tmp_path / 'shared').mkdir()
+    (tmp_path / 'shared' / 'proto.tex').write_text(
+        '\\section{Protocol: 1000-1030}\n')
+    expected = [('2016-01-04.tex', [('Sequencing', 60), ('Protocol', 30)])]
+    assert timesheet.process_labbooks([str(tmp_path / '2016')],
+                                      logger=LOGGER) == expected
+
+    archive = str(tmp_path / '2016.zip')
+    archives.pack_labbooks(str(tmp_path / '2016'), archive, LOGGER)
+    basedir = os.path.join(archive, '01', '2016-01-04')
+    assert timesheet.resolve_include('../../../shared/proto', basedir) == \
+        str(tmp_path / 'shared' / 'proto.tex')
+    assert timesheet.process_labbooks([archive], logger=LOGGER) == expected
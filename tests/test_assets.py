@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_assets.py
+
+Tests for managing the graphics included in lab books
+
+Run with `python -m pytest` from the repository root.
+"""
+
+import os
+
+from labbook import assets
+
+
+def test_find_unused():
+    """Graphics are in use if named relative to their graphics directory,
+    or relative to the directory containing it, with or without their
+    extension."""
+    graphics_dir = os.path.join(os.sep, 'lb', '2017-07-03', 'graphics')
+    paths = [os.path.join(graphics_dir, *name.split('/')) for name in
+             ('img1.png', 'img2.png', 'plots/img3.pdf', 'img4.png',
+              'img5.png')]
+    references = {'img1.png', 'plots/img3', 'graphics/img4.png',
+                  './graphics/img5'}
+    assert assets.find_unused({graphics_dir: paths}, references) == \
+        [paths[1]]
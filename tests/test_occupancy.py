@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_occupancy.py
+
+Tests for tabulating when in the day time is recorded
+
+Run with `python -m pytest` from the repository root.
+"""
+
+import pytest
+
+from labbook import occupancy
+
+
+def test_past_midnight_counts_on_next_day():
+    """Time after midnight is counted on the next weekday, and for the
+    next day's date window."""
+    intervals = [('2017-07-04.tex', [('Late', [(23 * 60, 25 * 60)])]),
+                 ('notes.tex', [('Late', [(23 * 60, 25 * 60)])])]
+    rows, columns, matrix = occupancy.occupancy_table(intervals, 'weekday',
+                                                      binsize=60)
+    assert rows == ['Tue', 'Wed']
+    assert matrix[0].tolist() == [0] * 23 + [60]
+    assert matrix[1].tolist() == [60] + [0] * 23
+
+    rows, columns, matrix = occupancy.occupancy_table(intervals, 'topic',
+                                                      binsize=60)
+    assert matrix.tolist() == [[120] + [0] * 22 + [120]]
+
+
+def test_bad_binsize():
+    """Bin sizes that don't divide a day are rejected."""
+    with pytest.raises(ValueError):
+        occupancy.check_binsize(7)
+    with pytest.raises(ValueError):
+        occupancy.occupancy_table([], binsize=0)
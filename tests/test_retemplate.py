@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_retemplate.py
+
+Tests for updating lab book headers after YAML config changes
+
+Run with `python -m pytest` from the repository root.
+"""
+
+import copy
+import logging
+
+import pytest
+
+from labbook import retemplate
+from labbook.subcommands import build_project_header
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def project(number, activity, description, name, subsections=()):
+    """Returns a project as loaded from a YAML config."""
+    proj = {'number': number, 'activity': activity,
+            'description': description, 'name': name}
+    if subsections:
+        proj['subsections'] = [{'name': sub} for sub in subsections]
+    return proj
+
+
+@pytest.fixture
+def old_projects():
+    """Projects from a config that lab books were written with."""
+    return [project('E000275-00', '8200-00', 'Project Time',
+                    'BBSRC - Responsive Mode'),
+            project('S200004-00', '8200-00', 'Project Time',
+                    'Theme 2 WP2.1 RD4 (Dickeya, phylogenomics)'),
+            project('S200004-00', '8200-00', 'Project Time',
+                    'Theme 2 WP2.1 RD5 (Pectobacterium, diagnostics)'),
+            project('T000640-11', '8000-10', 'Annual Leave',
+                    'ICS group costs Timesheets'),
+            project('T000640-11', '8050-10', 'Training',
+                    'ICS group costs Timesheets',
+                    ['Reading literature']),
+            project('T000640-11', '8050-30', 'Teaching/Mentoring/Reviewing',
+                    'ICS group costs Timesheets',
+                    ['Ad hoc guidance', 'Reviewing'])]
+
+
+def labbook_text(projects):
+    """Returns lab book text containing the headers for projects."""
+    return '\\begin{document}' + \
+        ''.join(build_project_header(proj) for proj in projects) + \
+        '\n\\end{document}\n'
+
+
+def test_unchanged_config(old_projects):
+    """An unchanged config changes no headers."""
+    mapping = retemplate.build_mapping(old_projects,
+                                       copy.deepcopy(old_projects))
+    assert mapping == {'section': {}, 'subsection': {}, 'heading': {}}
+
+
+def test_removal_and_addition(old_projects):
+    """Removing one project and adding another doesn't remap the rest."""
+    new_projects = copy.deepcopy(old_projects)
+    del new_projects[1]
+    new_projects.append(project('E000999-00', '8200-00', 'Project Time',
+                                'New grant'))
+    mapping = retemplate.build_mapping(old_projects, new_projects,
+                                       logger=LOGGER)
+    assert mapping == {'section': {}, 'subsection': {}, 'heading': {}}
+
+
+def test_reorder_and_code_change(old_projects):
+    """Projects are paired by number and activity, or by description and
+    name, wherever they are in the config."""
+    new_projects = copy.deepcopy(old_projects)
+    new_projects.reverse()
+    new_projects[-1]['name'] = 'BBSRC - Responsive Mode 2018'
+    new_projects[0]['number'] = 'T000640-12'
+    mapping = retemplate.build_mapping(old_projects, new_projects)
+    assert mapping['section'] == {
+        'E000275-00 Project Time, BBSRC - Responsive Mode':
+        'E000275-00 Project Time, BBSRC - Responsive Mode 2018',
+        'T000640-11 Teaching/Mentoring/Reviewing, ICS group costs Timesheets':
+        'T000640-12 Teaching/Mentoring/Reviewing, ICS group costs Timesheets'}
+    assert list(mapping['heading']) == [
+        '%% Project Time, BBSRC - Responsive Mode']
+    assert mapping['subsection'] == {}
+
+
+def test_ambiguous_projects(old_projects, caplog):
+    """Projects with the same number and activity that both change are left
+    alone unless they are renamed explicitly."""
+    new_projects = copy.deepcopy(old_projects)
+    new_projects[1]['name'] = 'Theme 2 WP2.1 RD4 (Dickeya)'
+    new_projects[2]['name'] = 'Theme 2 WP2.1 RD5 (Pectobacterium)'
+    with caplog.at_level(logging.WARNING):
+        mapping = retemplate.build_mapping(old_projects, new_projects,
+                                           logger=LOGGER)
+    assert mapping['section'] == {}
+    assert 'RD4 (Dickeya, phylogenomics)' in caplog.text
+
+    renames = retemplate.parse_renames([
+        '%s=>%s' % (retemplate.section_title(old_projects[idx]),
+                    retemplate.section_title(new_projects[idx]))
+        for idx in (1, 2)])
+    mapping = retemplate.build_mapping(old_projects, new_projects, renames)
+    assert sorted(mapping['section'].values()) == [
+        'S200004-00 Project Time, Theme 2 WP2.1 RD4 (Dickeya)',
+        'S200004-00 Project Time, Theme 2 WP2.1 RD5 (Pectobacterium)']
+
+
+def test_bad_renames(old_projects):
+    """Renames must be well-formed, and name projects in both configs."""
+    with pytest.raises(ValueError):
+        retemplate.parse_renames(['no arrow here'])
+    with pytest.raises(ValueError):
+        retemplate.build_mapping(old_projects, old_projects,
+                                 {'Not a project': 'Nor this'})
+
+
+def test_subsections(old_projects, caplog):
+    """Subsections are paired by name, then by position if the same number
+    remain; otherwise they are left alone."""
+    new_projects = copy.deepcopy(old_projects)
+    new_projects[5]['subsections'] = [{'name': 'Reviewing'},
+                                      {'name': 'Ad-hoc guidance'}]
+    new_projects[4]['subsections'] = [{'name': 'Reading papers'},
+                                      {'name': 'Courses'}]
+    with caplog.at_level(logging.WARNING):
+        mapping = retemplate.build_mapping(old_projects, new_projects,
+                                           logger=LOGGER)
+    assert mapping['subsection'] == {'Ad hoc guidance': 'Ad-hoc guidance'}
+    assert 'Reading literature' in caplog.text
+
+
+def test_rewrite_round_trip(old_projects, tmp_path):
+    """Rewriting a lab book gives the headers written from the new config,
+    and leaves everything else alone."""
+    new_projects = copy.deepcopy(old_projects)
+    new_projects[0]['name'] = 'BBSRC - Responsive Mode 2018'
+    new_projects[3]['number'] = 'T000640-12'
+    new_projects[5]['subsections'][0]['name'] = 'Ad-hoc guidance'
+    mapping = retemplate.build_mapping(old_projects, new_projects)
+
+    path = tmp_path / '2017-07-03.tex'
+    path.write_text(labbook_text(old_projects), encoding='utf-8')
+    diff = retemplate.retemplate_file(str(path), mapping, dry_run=True)
+    assert diff
+    assert path.read_text(encoding='utf-8') == labbook_text(old_projects)
+
+    assert retemplate.retemplate_file(str(path), mapping) == diff
+    assert path.read_text(encoding='utf-8') == labbook_text(new_projects)
+    assert retemplate.retemplate_file(str(path), mapping) == ''
+
+
+def test_unreadable_labbook(old_projects, tmp_path):
+    """A lab book that isn't UTF-8 is reported and left alone, and doesn't
+    stop the others being rewritten."""
+    new_projects = copy.deepcopy(old_projects)
+    new_projects[0]['name'] = 'BBSRC - Responsive Mode 2018'
+    mapping = retemplate.build_mapping(old_projects, new_projects)
+
+    badpath = tmp_path / '2017-07-03.tex'
+    badtext = labbook_text(old_projects).encode('utf-8') + b'caf\xe9\n'
+    badpath.write_bytes(badtext)
+    goodpath = tmp_path / '2017-07-04.tex'
+    goodpath.write_text(labbook_text(old_projects), encoding='utf-8')
+
+    results = list(retemplate.retemplate_files([str(badpath), str(goodpath)],
+                                               mapping, workers=2))
+    assert [path for path, diff, error in results] == [str(badpath),
+                                                       str(goodpath)]
+    assert results[0][1] == '' and 'UnicodeDecodeError' in results[0][2]
+    assert results[1][1] and results[1][2] is None
+    assert badpath.read_bytes() == badtext
+    assert goodpath.read_text(encoding='utf-8') == labbook_text(new_projects)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""test_timesheet.py
+
+Tests for scraping and comparing the time ranges recorded in lab books
+
+Run with `python -m pytest` from the repository root.
+"""
+
+import io
+import logging
+
+from labbook import timesheet
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def test_merge_intervals():
+    """Overlapping ranges are merged in one sweep, and time covered more
+    than once is counted once in MERGED and the rest in DOUBLED."""
+    ranges = [(540, 600, 'A'), (570, 660, 'B'), (580, 590, 'C'),
+              (720, 780, 'D'), (780, 800, 'E'), (900, 900, 'F')]
+    merged, overlaps, gaps, doubled = timesheet.merge_intervals(ranges)
+    assert merged == [[540, 660], [720, 800]]
+    assert overlaps == [((540, 600, 'A'), (570, 660, 'B'), 30),
+                        ((570, 660, 'B'), (580, 590, 'C'), 10)]
+    assert gaps == [(660, 720)]
+    assert doubled == 40
+    recorded = sum(end - start for start, end, topic in ranges)
+    assert recorded == sum(end - start for start, end in merged) + doubled
+
+
+def test_merge_intervals_nested():
+    """Ranges nested within an earlier range are counted once, and DOUBLED
+    is never negative."""
+    ranges = [(0, 600, 'A'), (60, 120, 'B'), (100, 200, 'C'),
+              (130, 140, 'D')]
+    merged, overlaps, gaps, doubled = timesheet.merge_intervals(ranges)
+    assert merged == [[0, 600]]
+    assert gaps == []
+    assert doubled == 60 + 100 + 10
+    assert timesheet.merge_intervals([(90, 80, 'A')])[3] == 0
+
+
+def test_invalid_ranges_dropped(tmp_path, caplog):
+    """Ranges that start after 2400 or end before they start are reported,
+    and dropped from recorded and wall-clock time alike."""
+    labbook = tmp_path / '2017-07-03.tex'
+    labbook.write_text('\\section{Email: 2430-0100, 0900-0930}\n'
+                       '\\section{Reading: 0130-0120, 0915-1000}\n'
+                       '\\section{Writing: 2330-0030}\n')
+    with caplog.at_level(logging.WARNING):
+        intervals = timesheet.process_labbooks([str(tmp_path)],
+                                               timesheet.scrape_intervals,
+                                               LOGGER)
+    assert '2430-0100 under Email' in caplog.text
+    assert '0130-0120 under Reading' in caplog.text
+    assert intervals == [('2017-07-03.tex',
+                          [('Email', [(540, 570)]),
+                           ('Reading', [(555, 600)]),
+                           ('Writing', [(1410, 1470)])])]
+    times = timesheet.intervals_to_times(intervals)
+    assert times == timesheet.process_labbooks([str(tmp_path)],
+                                               logger=LOGGER)
+    assert timesheet.wallclock_time(intervals) == 60 + 60
+
+    report = io.StringIO()
+    timesheet.report_conflicts(intervals, report)
+    assert 'Recorded: 2.25h\tWall-clock: 2.00h' in report.getvalue()
+    assert 'Time counted more than once: 0h15m\t0.25h' in report.getvalue()